@@ -0,0 +1,18 @@
+import os
+import shutil
+
+# Construit les fichiers statiques empreintés (page d'accueil et variantes gzip/brotli) dans static/dist.
+# Lancé au déploiement par bin/post_compile ; à relancer en local après avoir modifié templates/index.html.
+# Usage : python buildassets.py
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.pop('FLASK_RUN_FROM_CLI', None)
+
+from kokuahuane import STATIC_DIST_DIR, app, build_landing_assets
+
+# Les anciennes empreintes ne servent plus à rien : on repart d'un dossier vide
+shutil.rmtree(STATIC_DIST_DIR, ignore_errors=True)
+with app.app_context():
+    manifest = build_landing_assets()
+
+for logical_name, asset in manifest.items():
+    print(f"{logical_name} -> {asset['file']} ({', '.join(asset['encodings'])})")
@@ -0,0 +1,64 @@
+import os
+import sys
+
+# Vérifie que la catégorie d'un événement suit sa description : fixée à l'enregistrement, recalculée
+# quand /update_event change le texte, et remise dans la file de classify-events quand le classifieur
+# local hésite. L'API est remplacée par une réponse locale : aucun appel réseau.
+# Usage : DATABASE_URL=postgresql://localhost/kokua_check python categorycheck.py
+# La base doit être jetable : les tables y sont créées puis supprimées.
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('JWT_SECRET_KEY', 'categorycheck-' + 'x' * 32)
+os.environ.pop('FLASK_RUN_FROM_CLI', None)
+
+import kokuahuane
+from kokuahuane import PositiveEvent, User, app, classify_pending_events, db, issue_tokens, save_event, usage_ledger
+
+
+class StubResponse:
+    status_code = 200
+    text = ''
+
+    def json(self):
+        return {"choices": [{"message": {"content": '{"1": "creativite"}'}}], "usage": {}}
+
+
+class StubSession:
+    def post(self, url, json=None, **kwargs):
+        return StubResponse()
+
+
+kokuahuane.openai_session = lambda: StubSession()
+kokuahuane.model_router.shadow_model = lambda config_type, config, served_model: None
+
+
+def category(event_id):
+    db.session.expire_all()
+    return db.session.get(PositiveEvent, event_id).category
+
+
+with app.app_context():
+    db.create_all()
+    try:
+        user = User(email="categorycheck@kokua.invalid", password='-', display_name="check")
+        db.session.add(user)
+        db.session.commit()
+        headers = {"Authorization": f"Bearer {issue_tokens(user, refresh=False)['access_token']}"}
+        client = app.test_client()
+
+        save_event(user.id, "Tu as couru un footing")
+        event_id = db.session.query(PositiveEvent.id).filter_by(user_id=user.id).scalar()
+        steps = [category(event_id)]
+        for description in ("Tu as dîné avec des amis", "Tu as fait quelque chose de nouveau"):
+            response = client.post(f'/update_event/{event_id}', json={"description": description}, headers=headers)
+            assert response.status_code == 200, response.data
+            steps.append(category(event_id))
+        classify_pending_events(concurrency=1)
+        steps.append(category(event_id))
+        print(" -> ".join(str(step) for step in steps))
+        ok = steps == ['sport', 'social', None, 'creativite']
+    finally:
+        usage_ledger.flush()
+        db.session.rollback()
+        db.drop_all()
+
+sys.exit(0 if ok else 1)
@@ -0,0 +1,213 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+# Évalue les configurations de gpt_config.json sur un corpus d'entrées et de sorties attendues (evals/<tâche>.jsonl),
+# en parallèle, et affiche pour chaque configuration et chaque modèle candidat : précision, tokens de sortie,
+# latence et coût estimé. Les réponses enregistrées dans evals/cache sont rejouées : aucun appel réseau par défaut.
+# Le dépôt ne contient pas encore de cache : un premier --record (OPENAI_API_KEY) est nécessaire, sans quoi
+# aucun cas n'est évalué. Committer ensuite evals/cache avec le corpus pour que les passages suivants le rejouent.
+# Usage :
+#   python evalprompts.py --record                 # enregistre dans evals/cache les réponses de l'API OpenAI
+#   python evalprompts.py                          # rejoue le cache ; les cas absents du cache sont comptés à part
+#   python evalprompts.py --stand-in http://localhost:11434/v1 --record   # serveur local compatible OpenAI
+#   python evalprompts.py --config-file essai.json --only record          # comparer une variante de prompt
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.pop('FLASK_RUN_FROM_CLI', None)
+
+import kokuahuane
+from kokuahuane import MODEL_PRICES, answers_agree, chat_request, gpt_config, model_cost, openai_session
+
+logging.getLogger('urllib3').setLevel(logging.WARNING)
+
+EVALS_DIR = 'evals'
+CACHE_DIR = os.path.join(EVALS_DIR, 'cache')
+OPENAI_URL = 'https://api.openai.com/v1'
+NO_EVENT_ANSWERS = ('', 'flag')
+
+# Tâche évaluée -> configurations qui la remplissent
+TASKS = {
+    'record': ['record', 'recordback', 'recordback2'],
+    'detect_intent': ['detect_intent'],
+}
+
+
+def normalize(text):
+    decomposed = unicodedata.normalize('NFKD', text.strip().strip("'\".").lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def score_record(output, expected):
+    # Pas d'événement attendu : réponse vide ou mot-clé 'flag' selon la configuration
+    if expected is None:
+        return normalize(output) in NO_EVENT_ANSWERS
+    return normalize(output) not in NO_EVENT_ANSWERS and answers_agree(output, expected)
+
+
+def score_exact(output, expected):
+    return normalize(output) == normalize(expected)
+
+
+SCORERS = {
+    'record': score_record,
+    'detect_intent': score_exact,
+}
+
+
+def load_cases(task):
+    with open(os.path.join(EVALS_DIR, f'{task}.jsonl'), 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def cache_path(base_url, data):
+    key = hashlib.sha256(json.dumps({"url": base_url, "request": data}, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f'{key}.json')
+
+
+_stand_in_session = None
+
+
+def stand_in_session():
+    # Session sans l'en-tête Authorization de openai_session() : la clé OpenAI n'est jamais envoyée
+    # à un serveur de remplacement
+    global _stand_in_session
+    if _stand_in_session is None:
+        import requests
+        _stand_in_session = requests.Session()
+        _stand_in_session.headers.update({'Content-Type': 'application/json'})
+    return _stand_in_session
+
+
+def complete(base_url, data, record):
+    # Renvoie (réponse, latence en ms) ou None si le cas n'est pas en cache et qu'on n'enregistre pas.
+    path = cache_path(base_url, data)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            cached = json.load(file)
+        return cached['response'], cached['latency_ms']
+    if not record:
+        return None
+
+    session = openai_session() if base_url == OPENAI_URL else stand_in_session()
+    started = time.monotonic()
+    response = session.post(f'{base_url}/chat/completions', json=data, timeout=120)
+    latency_ms = (time.monotonic() - started) * 1000
+    response.raise_for_status()
+    payload = response.json()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({"request": data, "response": payload, "latency_ms": latency_ms}, file, ensure_ascii=False, indent=1)
+    return payload, latency_ms
+
+
+def run_case(base_url, record, config_type, model, task, case):
+    data = chat_request(config_type, case['input'], model=model)
+    result = complete(base_url, data, record)
+    if result is None:
+        return None
+    payload, latency_ms = result
+    output = payload['choices'][0]['message']['content']
+    usage = payload.get('usage', {})
+    return {
+        "correct": SCORERS[task](output, case['expected']),
+        "output_tokens": usage.get('completion_tokens', 0),
+        "cost": model_cost(model, usage),
+        "latency_ms": latency_ms,
+        "output": output,
+        "input": case['input'],
+        "expected": case['expected'],
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def variants(config_type):
+    config = gpt_config(config_type)
+    return [config['model']] + [model for model in config.get('candidates', []) if model != config['model']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Évaluation hors ligne des configurations GPT")
+    parser.add_argument('--only', action='append', help="Configuration(s) à évaluer, toutes par défaut")
+    parser.add_argument('--config-file', help="Autre fichier de configurations que gpt_config.json")
+    parser.add_argument('--stand-in', help="URL d'un serveur local compatible OpenAI (…/v1)")
+    parser.add_argument('--record', action='store_true', help="Appelle l'API pour les cas absents du cache")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--tolerance', type=float, default=0.02, help="Perte de précision acceptée pour un modèle moins cher")
+    parser.add_argument('--show-failures', action='store_true')
+    args = parser.parse_args()
+
+    if args.config_file:
+        kokuahuane.GPT_CONFIG_PATH = args.config_file
+    base_url = (args.stand_in or OPENAI_URL).rstrip('/')
+
+    jobs = []
+    for task, config_types in TASKS.items():
+        cases = load_cases(task)
+        for config_type in config_types:
+            if args.only and config_type not in args.only:
+                continue
+            for model in variants(config_type):
+                jobs.extend((config_type, model, task, case) for case in cases)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda job: (job[:2], run_case(base_url, args.record, *job)), jobs))
+
+    grouped = {}
+    for key, result in results:
+        grouped.setdefault(key, []).append(result)
+
+    rows = []
+    print(f"{'configuration':<28}{'cas':>5}{'absents':>9}{'précision':>11}{'tokens sortie':>15}{'p50 ms':>9}{'p95 ms':>9}{'$ / 1000':>10}")
+    for (config_type, model), outcomes in grouped.items():
+        done = [outcome for outcome in outcomes if outcome is not None]
+        missing = len(outcomes) - len(done)
+        name = f"{config_type}@{model}"
+        if not done:
+            print(f"{name:<28}{len(outcomes):>5}{missing:>9}{'-':>11}")
+            continue
+        accuracy = sum(outcome['correct'] for outcome in done) / len(done)
+        latencies = [outcome['latency_ms'] for outcome in done]
+        cost = 1000 * statistics.mean(outcome['cost'] for outcome in done)
+        tokens = statistics.mean(outcome['output_tokens'] for outcome in done)
+        rows.append((config_type, model, accuracy, cost, percentile(latencies, 0.5)))
+        print(f"{name:<28}{len(outcomes):>5}{missing:>9}{accuracy:>10.0%} {tokens:>14.1f}"
+              f"{percentile(latencies, 0.5):>9.0f}{percentile(latencies, 0.95):>9.0f}{cost:>10.3f}")
+        if args.show_failures:
+            for outcome in done:
+                if not outcome['correct']:
+                    print(f"    ✗ {outcome['input']!r} -> {outcome['output']!r} (attendu {outcome['expected']!r})")
+
+    # Pour chaque tâche : la variante la moins chère (puis la plus rapide) dont la précision reste
+    # à `tolerance` de la meilleure
+    for task, config_types in TASKS.items():
+        candidates = [row for row in rows if row[0] in config_types]
+        if not candidates:
+            continue
+        best_accuracy = max(row[2] for row in candidates)
+        eligible = [row for row in candidates if row[2] >= best_accuracy - args.tolerance]
+        config_type, model, accuracy, cost, latency = min(eligible, key=lambda row: (row[3], row[4]))
+        print(f"{task} : {config_type}@{model} ({accuracy:.0%}, {cost:.3f} $ / 1000 appels, p50 {latency:.0f} ms)")
+
+    unpriced = {model for _, model in grouped if model not in MODEL_PRICES}
+    if unpriced:
+        print(f"(prix inconnus, comptés à 0 : {', '.join(sorted(unpriced))})")
+    if any(result is None for _, result in results) and not args.record:
+        print("(cas absents du cache : relancer avec --record pour les enregistrer)")
+    if not rows:
+        # Rien n'a été évalué : un code de sortie nul ferait passer un cache vide pour une évaluation réussie
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+# Configuration gunicorn, chargée automatiquement depuis la racine du projet.
+# Le nombre de workers reste piloté par WEB_CONCURRENCY (Heroku).
+
+# Workers asynchrones : un flux SSE ouvert (/events/stream) ne coûte qu'une greenlet.
+worker_class = 'gevent'
+worker_connections = 1000
+
+# L'application est importée une fois dans le master puis partagée par fork :
+# un nouveau worker n'a plus rien à importer avant de servir.
+preload_app = True
+
+
+def when_ready(server):
+    # Dans le master, avant le premier fork : configuration GPT et utilisateurs actifs
+    # sont chargés une fois dans le cache partagé au lieu de l'être par chaque worker,
+    # et chaque worker hérite des reformulations les plus utilisées déjà en mémoire.
+    from kokuahuane import app, gpt_config, rewrite_store, sync_revocations, warm_user_ids
+    gpt_config('record')
+    try:
+        with app.app_context():
+            server.log.info("Warmed %s user ids", warm_user_ids())
+            sync_revocations(force_rebuild=True)
+            rewrite_store.warm()
+    except Exception as e:
+        server.log.warning("Shared cache warm-up failed: %s", e)
+
+
+def post_fork(server, worker):
+    # Rend psycopg2 coopératif avec gevent, sinon une requête SQL bloque tout le worker.
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+    # Aucune connexion SQL ne doit être partagée entre le master et les workers.
+    from kokuahuane import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,24 @@
+import sys
+import io
+from kokuahuane import app, User, import_events, guess_import_format
+
+# Importe un fichier NDJSON ou CSV dans le journal d'un utilisateur, sans passer par l'API.
+# Usage : python importevents.py email@exemple.fr journal.ndjson [ndjson|csv]
+if len(sys.argv) < 3:
+    print("Usage : python importevents.py <email> <fichier> [ndjson|csv]")
+    sys.exit(1)
+
+email, path = sys.argv[1], sys.argv[2]
+import_format = guess_import_format(path, sys.argv[3] if len(sys.argv) > 3 else None)
+
+with app.app_context():
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        print(f"Utilisateur introuvable : {email}")
+        sys.exit(1)
+    with io.open(path, encoding='utf-8-sig', newline='') as text_stream:
+        result = import_events(user.id, text_stream, import_format)
+
+print(f"{result['imported']} événements importés, {result['rejected']} lignes rejetées")
+for error in result['errors']:
+    print(f"  ligne {error['line']} : {error['error']}")
@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# Mesure le coût par requête de la vérification des jetons : décodage et signature, test du filtre
+# de révocation, et pour comparaison la requête SQL qu'il évite.
+# Usage : python jwtbench.py [nombre d'itérations]
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('JWT_SECRET_KEY', 'jwtbench-' + 'x' * 32)
+os.environ.pop('FLASK_RUN_FROM_CLI', None)
+
+from flask_jwt_extended import decode_token
+from sqlalchemy import exists
+
+from kokuahuane import RevokedToken, User, app, db, issue_tokens, revocation_filter
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+REVOKED_SAMPLE = 10000
+
+
+def measure(label, fn, runs=iterations):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / runs * 1e6:8.1f} µs")
+
+
+with app.app_context():
+    db.create_all()
+    user = User(email='bench@kokua.fr', password='-')
+    db.session.add(user)
+    db.session.commit()
+    token = issue_tokens(user, refresh=False)['access_token']
+    jti = decode_token(token)['jti']
+
+    expires_at = datetime.utcnow() + timedelta(hours=1)
+    revoked = [str(uuid.uuid4()) for _ in range(REVOKED_SAMPLE)]
+    db.session.bulk_insert_mappings(RevokedToken, [
+        {"jti": value, "token_type": 'access', "expires_at": expires_at} for value in revoked
+    ])
+    db.session.commit()
+    revocation_filter.replace(revoked, 0)
+
+    with app.test_request_context(headers={'Authorization': f'Bearer {token}'}):
+        measure("décodage + signature (HS256)", lambda: decode_token(token))
+        measure("filtre de révocation (jeton valide)", lambda: revocation_filter.might_contain(jti))
+        measure("requête SQL de révocation (évitée)", lambda: db.session.query(exists().where(RevokedToken.jti == jti)).scalar(), runs=max(iterations // 10, 1))
+
+    false_positives = sum(revocation_filter.might_contain(str(uuid.uuid4())) for _ in range(iterations))
+    print(f"Faux positifs du filtre : {false_positives / iterations:.3%} avec {REVOKED_SAMPLE} jetons révoqués")
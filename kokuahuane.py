@@ -1,17 +1,51 @@
-from flask import Flask, request, render_template, jsonify, make_response
+from flask import Blueprint, Flask, Response, current_app, has_app_context, has_request_context, request, render_template, jsonify, make_response, send_file, stream_with_context
 import os
-import requests
 from flask_cors import CORS, cross_origin
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, decode_token, jwt_required, get_jwt, get_jwt_identity, verify_jwt_in_request
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import REAL, any_, bindparam, case, cast, column, event as sa_event, exists, func, literal, text, tuple_
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_migrate import Migrate
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-from dateutil import parser
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import atexit
 import json
+from functools import wraps
 import sys
 import logging
+import queue
+import select
+import threading
+import time
+import gzip
+import zlib
+import csv
+import io
+import re
+import heapq
+import unicodedata
+import itertools
+import click
+import hashlib
+import base64
+import tempfile
+import mmap
+import struct
+import multiprocessing
+import random
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson  # Encodeur JSON rapide, optionnel
+except ImportError:
+    orjson = None
+
+try:
+    import brotli  # Compression brotli, optionnelle
+except ImportError:
+    brotli = None
 
 
 
@@ -26,38 +60,50 @@ headers = {
     'Content-Type': 'application/json'
 }
 
-# Initialisation de l'application Flask.
-app = Flask(__name__)
+# Extensions et routes sont déclarées sans application : elles sont branchées par create_app().
+# Même nom de logger que app.logger, utilisable aussi hors contexte Flask (threads, CLI).
+logger = logging.getLogger(__name__)
+db = SQLAlchemy()
+jwt = JWTManager()
+bp = Blueprint('kokua', __name__, cli_group=None)
 
 
+def create_app():
+    # Fabrique de l'application. Rien ici ne se connecte à la base : les workers gunicorn
+    # (preload_app) démarrent sans attendre PostgreSQL, la connexion s'ouvre à la première requête.
+    app = Flask(__name__)
 
-# Configuration de l'URI de la base de données à partir des variables d'environnement.
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL').replace("postgres://", "postgresql://", 1)
+    # Configuration de l'URI de la base de données à partir des variables d'environnement.
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL').replace("postgres://", "postgresql://", 1)
 
+    # Configuration du logging
+    app.config['DEBUG'] = True  # Active le mode debug, qui est utile pour le développement
+    app.config['LOGGING_LEVEL'] = 'DEBUG'  # Définit le niveau de logging à debug pour voir plus de détails dans les logs
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Configuration du logging
-app.config['DEBUG'] = True  # Active le mode debug, qui est utile pour le développement
-app.config['LOGGING_LEVEL'] = 'DEBUG'  # Définit le niveau de logging à debug pour voir plus de détails dans les logs
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+    db.init_app(app)
 
+    # Configuration du secret pour JWT.
+    app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = ACCESS_TOKEN_EXPIRES
+    app.config['JWT_REFRESH_TOKEN_EXPIRES'] = REFRESH_TOKEN_EXPIRES
+    jwt.init_app(app)
 
+    # Configuration de CORS pour permettre les requêtes cross-origin.
+    CORS(app, supports_credentials=True, origins=["https://kokua.fr", "https://www.kokua.fr"], allow_headers=["Authorization", "Content-Type", "If-None-Match", "Idempotency-Key"], expose_headers=["ETag", "Idempotent-Replayed"], methods=["GET", "POST", "DELETE", "OPTIONS"])
 
-# Affichage de l'URI de la base de données pour vérification
-print("Database URI:", app.config['SQLALCHEMY_DATABASE_URI'])
+    app.register_blueprint(bp)
+    usage_ledger.init_app(app)
 
-db = SQLAlchemy(app)
+    # Flask-Migrate (et tout Alembic) ne sert qu'aux commandes `flask db ...` : inutile de le charger dans les workers
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        Migrate(app, db)
 
-# Initialisation de Flask-Migrate
-migrate = Migrate(app, db)
+    return app
 
 
-
-# Configuration du secret pour JWT.
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
-jwt = JWTManager(app)
-
-
-# Configuration de CORS pour permettre les requêtes cross-origin.
+# Anciennes règles CORS par route, remplacées par la configuration globale de create_app().
 # CORS(app, supports_credentials=True, resources={
 #     r"/ask": {"origins": ["https://kokua.fr", "https://www.kokua.fr"]},
 #     r"/login": {"origins": ["https://kokua.fr", "https://www.kokua.fr"]},
@@ -75,16 +121,15 @@ jwt = JWTManager(app)
 # })
 
 
-
-CORS(app, supports_credentials=True, origins=["https://kokua.fr", "https://www.kokua.fr"], allow_headers=["Authorization", "Content-Type"], methods=["GET", "POST", "DELETE", "OPTIONS"])
-
-
 # Modèle utilisateur pour SQLAlchemy.
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)  # Assurez-vous que l'email est unique
     password = db.Column(db.String(255), nullable=False)
     display_name = db.Column(db.String(80), nullable=True)  # Pour le prénom ou pseudo affiché
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Incrémenté à chaque modification d'événement ou de favori
+    is_admin = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    timezone = db.Column(db.String(64), nullable=False, default='Europe/Paris', server_default='Europe/Paris')  # Nom IANA, sert au découpage des journées
 
 
     # Méthode pour vérifier le mot de passe.
@@ -140,31 +185,22 @@ def add_user(email, password, display_name=None):
 
 
 # Route racine pour afficher et répondre aux questions.
-@app.route('/', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
 def hello():
     if request.method == 'POST':
         question = request.form['question']
-        response = ask_chatgpt(question)
+        response = ask_landing_question(question)
         return render_template('index.html', question=question, response=response)
-    return render_template('index.html', question=None, response=None)
+    return send_static_asset('index.html')
 
 
 
-# Route pour connaitre la liste des utilisateurs.
-@app.route('/users', methods=['GET'])
-def list_users():
-    try:
-        users = User.query.all()  # Récupère tous les utilisateurs de la base de données
-        users_data = [{'id': user.id, 'username': user.username} for user in users]
-        return jsonify(users_data), 200
-    except Exception as e:
-        app.logger.error(f"Failed to fetch users: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+# La liste des utilisateurs (/users) est réservée aux administrateurs : voir EXTENSION 19.
 
 
 
 # Route pour enregistrer un nouvel utilisateur.
-@app.route('/register', methods=['POST', 'OPTIONS'])
+@bp.route('/register', methods=['POST', 'OPTIONS'])
 @cross_origin(origins=["https://kokua.fr", "https://www.kokua.fr"], supports_credentials=True)
 def register():
     if request.method == 'OPTIONS':
@@ -174,22 +210,26 @@ def register():
     email = data.get('email')
     password = data.get('password')
     display_name = data.get('display_name', '')  # Utiliser un display name facultatif
+    user_timezone = data.get('timezone') or DEFAULT_TIMEZONE
 
     if not email or not password:
         return jsonify({"error": "Missing email or password"}), 400
 
+    if not is_valid_timezone(user_timezone):
+        return jsonify({"error": "Unknown timezone"}), 400
+
     if User.query.filter_by(email=email).first():
         return jsonify({"error": "Email already in use"}), 409
 
     hashed_password = generate_password_hash(password)
-    new_user = User(email=email, password=hashed_password, display_name=display_name)
+    new_user = User(email=email, password=hashed_password, display_name=display_name, timezone=user_timezone)
     db.session.add(new_user)
     db.session.commit()
     return jsonify({"message": "User created successfully"}), 201
 
 
 # Route pour le processus de connexion.
-@app.route('/login', methods=['POST', 'OPTIONS'])
+@bp.route('/login', methods=['POST', 'OPTIONS'])
 def login():
     if request.method == 'OPTIONS':
         response = make_response()
@@ -210,13 +250,12 @@ def login():
         if not user.check_password(password):
             return jsonify({"msg": "Mot de passe invalide"}), 401  # Invalid password
 
-        access_token = create_access_token(identity=user.email)
-        return jsonify(access_token=access_token, displayName=user.display_name), 200
+        return jsonify(**issue_tokens(user), displayName=user.display_name), 200
 
 
 
 # # Route pour poser des questions via l'API, protégée par JWT.
-# @app.route('/ask', methods=['POST', 'OPTIONS'])
+# @bp.route('/ask', methods=['POST', 'OPTIONS'])
 # @jwt_required(optional=True)
 # def ask():
 #     if request.method == 'OPTIONS':
@@ -237,10 +276,23 @@ class PositiveEvent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     description = db.Column(db.String(500), nullable=False)
-    category = db.Column(db.String(100), nullable=True, default='souvenir')  # Default à 'souvenir'
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    category = db.Column(db.String(100), nullable=True)  # Fixée par classify_event_locally ; NULL = à classer (classify-events)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Clé de partition sur PostgreSQL
+    deleted_at = db.Column(db.DateTime, nullable=True)  # Suppression logique : toute lecture filtre sur deleted_at IS NULL
     user = db.relationship('User', backref=db.backref('positive_events', lazy=True))
 
+    # Index partiels (migrations b3e9d7c2a418 et c5f1a8e3b962), déclarés ici pour que autogenerate ne les supprime pas
+    __table_args__ = (
+        db.Index('ix_positive_event_user_date_live', 'user_id', 'date',
+                 postgresql_where=text('deleted_at IS NULL'), sqlite_where=text('deleted_at IS NULL')),
+        db.Index('ix_positive_event_deleted_at', 'deleted_at',
+                 postgresql_where=text('deleted_at IS NOT NULL'), sqlite_where=text('deleted_at IS NOT NULL')),
+        # File d'attente de classify-events
+        db.Index('ix_positive_event_uncategorized', 'id',
+                 postgresql_where=text('category IS NULL AND deleted_at IS NULL'),
+                 sqlite_where=text('category IS NULL AND deleted_at IS NULL')),
+    )
+
 
 def is_development():
     #Déterminer si l'application est en mode développement.#
@@ -265,16 +317,40 @@ def jwt_optional(fn):
 
 
 
-# Fonction pour interroger l'API ChatGPT d'OpenAI.
-def ask_chatgpt(prompt, config_type):
-    #Interroger l'API ChatGPT avec des paramètres spécifiques définis dans un fichier de configuration JSON.#
-    # Charge la configuration appropriée pour le type demandé
-    with open('gpt_config.json', 'r') as file:
-        config = json.load(file)[config_type]
+_openai_session = None
+
+
+def openai_session():
+    # Session HTTP partagée (connexions keep-alive vers l'API), créée au premier appel :
+    # `requests` n'est importé qu'à ce moment-là, pas au démarrage du worker.
+    global _openai_session
+    if _openai_session is None:
+        import requests
+        session = requests.Session()
+        session.headers.update(headers)
+        _openai_session = session
+    return _openai_session
 
-    data = {
-        'model': config['model'],
-        'messages': [{'role': 'user', 'content': f"{config['instructions']} {prompt}"}],
+
+def build_messages(config, prompt):
+    # Les instructions partent en message `system` et les exemples en tours user/assistant : ce préambule
+    # est identique, octet pour octet, d'un appel à l'autre pour une même configuration, ce qui permet
+    # au fournisseur de le mettre en cache. Seul le dernier message varie.
+    messages = [{'role': 'system', 'content': config['instructions']}]
+    for example in config.get('examples', []):
+        messages.append({'role': 'user', 'content': example['input']})
+        messages.append({'role': 'assistant', 'content': example['output']})
+    messages.append({'role': 'user', 'content': prompt})
+    return messages
+
+
+def chat_request(config_type, prompt, model=None):
+    # Corps de la requête chat/completions pour le type de configuration demandé.
+    # `model` force un modèle précis au lieu du choix du routeur (évaluations, comparaisons).
+    config = gpt_config(config_type)
+    return {
+        'model': model or model_router.choose(config_type, config),
+        'messages': build_messages(config, prompt),
         'max_tokens': config['max_tokens'],
         'temperature': config.get('temperature', 1),  # Valeur par défaut si non spécifiée
         'top_p': config.get('top_p', 1),  # Valeur par défaut si non spécifiée
@@ -282,15 +358,22 @@ def ask_chatgpt(prompt, config_type):
         'presence_penalty': config.get('presence_penalty', 0)  # Valeur par défaut
     }
 
-    response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data)
+
+# Fonction pour interroger l'API ChatGPT d'OpenAI.
+def ask_chatgpt(prompt, config_type):
+    #Interroger l'API ChatGPT avec des paramètres spécifiques définis dans un fichier de configuration JSON.#
+    # Charge la configuration appropriée pour le type demandé
+    data = chat_request(config_type, prompt)
+
+    response = post_chat_completion(config_type, data)
     if response.status_code == 200:
         return response.json()['choices'][0]['message']['content'].strip()
     else:
-        app.logger.error('Failed to receive valid response from OpenAI: %s', response.text)
+        logger.error('Failed to receive valid response from OpenAI: %s', response.text)
         return "Error processing your request."
 
 
-# @app.route('/interact', methods=['POST'])
+# @bp.route('/interact', methods=['POST'])
 # @jwt_required()
 # def interact():
 #     # Récupère l'identifiant de l'utilisateur à partir du token JWT
@@ -406,7 +489,7 @@ def ask_chatgpt(prompt, config_type):
 
 # !*zone de test ----------------------
 
-# @app.route('/test-date-conversion', methods=['POST'])
+# @bp.route('/test-date-conversion', methods=['POST'])
 # def test_date_conversion():
 #     return test_convert_date_range()
 
@@ -482,66 +565,178 @@ def ask_chatgpt(prompt, config_type):
 
 
 
+# ! clés d'idempotence, utilisées par les routes de mutation qui suivent ---------------
+
+# Un client qui renvoie une requête de mutation avec le même en-tête Idempotency-Key reçoit la réponse
+# enregistrée la première fois au lieu de refaire l'écriture. Les clés sont propres à chaque utilisateur
+# et expirent après IDEMPOTENCY_TTL. Les clés expirées sont effacées par la commande purge-idempotency-keys
+# (Heroku Scheduler, toutes les heures), jamais pendant une requête.
+IDEMPOTENCY_TTL = timedelta(hours=24)
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_PURGE_BATCH_SIZE = 5000
+
+
+class IdempotencyKey(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(IDEMPOTENCY_KEY_MAX_LENGTH), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # Empreinte de la requête d'origine
+    status_code = db.Column(db.Integer, nullable=True)  # Nul tant que la requête d'origine est en cours
+    body = db.Column(db.LargeBinary, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    __table_args__ = (db.UniqueConstraint('user_id', 'key'),)
+
+
+def request_fingerprint():
+    digest = hashlib.sha256(request.method.encode() + b' ' + request.full_path.encode() + b'\n')
+    if request.mimetype == 'multipart/form-data':
+        # La frontière multipart change à chaque envoi : on hache les champs et le contenu des fichiers
+        for name, value in sorted(request.form.items(multi=True)):
+            digest.update(f"{name}={value}\n".encode())
+        for name, upload in sorted(request.files.items(multi=True), key=lambda item: item[0]):
+            digest.update(f"{name}:{upload.filename}\n".encode())
+            for chunk in iter(lambda: upload.stream.read(65536), b''):
+                digest.update(chunk)
+            upload.stream.seek(0)
+    else:
+        digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def purge_expired_idempotency_keys(batch_size=IDEMPOTENCY_PURGE_BATCH_SIZE):
+    # Par lots, chacun dans sa transaction, trouvés par l'index sur expires_at
+    cutoff = datetime.utcnow()
+    purged = 0
+    while True:
+        key_ids = [key_id for key_id, in db.session.query(IdempotencyKey.id).filter(IdempotencyKey.expires_at < cutoff).limit(batch_size)]
+        if not key_ids:
+            return purged
+        IdempotencyKey.query.filter(IdempotencyKey.id.in_(key_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        purged += len(key_ids)
+
+
+@bp.cli.command('purge-idempotency-keys')
+@click.option('--batch-size', default=IDEMPOTENCY_PURGE_BATCH_SIZE, help="Nombre de clés effacées par transaction.")
+def purge_idempotency_keys_command(batch_size):
+    # flask --app kokuahuane purge-idempotency-keys
+    click.echo(f"Purged {purge_expired_idempotency_keys(batch_size)} expired idempotency keys")
+
+
+def idempotent(view):
+    # À placer sous @jwt_required() : l'utilisateur doit déjà être authentifié.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return jsonify({"error": "Idempotency-Key too long"}), 400
+        user_id = current_user_id()
+        if user_id is None:
+            return view(*args, **kwargs)
+
+        fingerprint = request_fingerprint()
+        record = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        if record is not None and record.expires_at < datetime.utcnow():
+            db.session.delete(record)
+            db.session.commit()
+            record = None
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                return jsonify({"error": "Idempotency-Key already used for a different request"}), 422
+            if record.status_code is None:
+                return jsonify({"error": "A request with this Idempotency-Key is in progress"}), 409
+            response = Response(record.body, status=record.status_code, mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        # Réserve la clé avant d'exécuter la requête : une relance simultanée tombe sur la contrainte unique
+        record = IdempotencyKey(user_id=user_id, key=key, fingerprint=fingerprint, expires_at=datetime.utcnow() + IDEMPOTENCY_TTL)
+        db.session.add(record)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({"error": "A request with this Idempotency-Key is in progress"}), 409
+        record_id = record.id
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            IdempotencyKey.query.filter_by(id=record_id).delete()
+            db.session.commit()
+            raise
+
+        if response.status_code >= 500:
+            # Erreur serveur : la clé est libérée pour que le client puisse réessayer
+            IdempotencyKey.query.filter_by(id=record_id).delete()
+        else:
+            IdempotencyKey.query.filter_by(id=record_id).update({
+                IdempotencyKey.status_code: response.status_code,
+                IdempotencyKey.body: response.get_data()
+            })
+        db.session.commit()
+        return response
+    return wrapper
+
+
+
+
 # ! EXTENSION 2 DU PROJET -------------------------------------------------------------------------------------------
 
 # Fonction pour interroger l'API OpenAI avec un prompt spécifique
 def ask_gpt_mood(prompt, config_type):
     # Charge la configuration appropriée pour le type demandé
-    with open('gpt_config.json', 'r') as file:
-        config = json.load(file)[config_type]
+    data = chat_request(config_type, prompt)
 
-    data = {
-        'model': config['model'],
-        'messages': [{'role': 'user', 'content': f"{config['instructions']} {prompt}"}],
-        'max_tokens': config['max_tokens'],
-        'temperature': config.get('temperature', 1),
-        'top_p': config.get('top_p', 1),
-        'frequency_penalty': config.get('frequency_penalty', 0),
-        'presence_penalty': config.get('presence_penalty', 0)
-    }
-
-    # Utilisation des headers globaux qui contiennent déjà la clé API correcte
-    response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data)
+    # Session partagée qui porte déjà les headers avec la clé API correcte ; le routeur mesure l'appel
+    response = post_chat_completion(config_type, data)
 
     if response.status_code == 200:
         json_response = response.json()
         # Log de la réponse complète de l'API pour faciliter le débogage
-        app.logger.debug(f"Réponse complète de l'API : {json_response}")
+        logger.debug(f"Réponse complète de l'API : {json_response}")
 
         # Vérifie la présence de 'choices' et extrait la réponse
         if 'choices' in json_response and len(json_response['choices']) > 0 and 'message' in json_response['choices'][0] and 'content' in json_response['choices'][0]['message']:
             content_extracted = json_response['choices'][0]['message']['content'].strip()
             # Log du contenu extrait pour voir ce qui a été précisément obtenu
-            app.logger.debug(f"Contenu extrait : {content_extracted}")
+            logger.debug(f"Contenu extrait : {content_extracted}")
             return content_extracted
         else:
             # Log la structure inattendue de la réponse pour aider à déboguer
-            app.logger.debug(f"Structure de réponse inattendue : {json_response}")
+            logger.debug(f"Structure de réponse inattendue : {json_response}")
             return None
     else:
         # Log de l'erreur de réponse de l'API pour aider à identifier le problème
-        app.logger.error(f"Échec de la réception d'une réponse valide d'OpenAI : {response.text}")
+        logger.error(f"Échec de la réception d'une réponse valide d'OpenAI : {response.text}")
         return None
 
 
 
-@app.route('/propose_event', methods=['POST'])
+@bp.route('/propose_event', methods=['POST'])
 @jwt_required()
 def propose_event():
-    user_email = get_jwt_identity()
-    user = User.query.filter_by(email=user_email).first()
+    user_id = current_user_id()
     
-    if not user:
+    if user_id is None:
         logging.error("User not found")
         return jsonify({"error": "User not found"}), 404
     
     user_input = request.json.get('question', '')
     logging.debug(f"User input: {user_input}")  # Log pour observer l'entrée utilisateur
     
-    # Appel pour tenter d'extraire un événement
-    event_detection = ask_gpt_mood(user_input, "record")
-
-    logging.debug(f"Detected event response: {event_detection}")  # Log pour observer la réponse de détection d'événement
+    # Réutilise la reformulation déjà obtenue pour une phrase identique, sinon appelle le modèle
+    event_detection = lookup_rewrite(user_input)
+    if event_detection is None:
+        # Appel pour tenter d'extraire un événement
+        event_detection = ask_gpt_mood(user_input, "record")
+        logging.debug(f"Detected event response: {event_detection}")  # Log pour observer la réponse de détection d'événement
+        if event_detection:
+            event_detection = ensure_tu_form(event_detection)
+            store_rewrite(user_input, event_detection)
 
     # # Vérifie si un événement clair est détecté
     # # if not event_detection or event_detection.strip().lower() == "flag":
@@ -558,10 +753,6 @@ def propose_event():
 
     # Vérifie si un événement a été détecté et est bien formulé
     if event_detection:
-        # Assurer la cohérence dans la formulation
-        if not event_detection.startswith("Tu "):
-            event_detection = "Tu " + event_detection[0].lower() + event_detection[1:]
-
         logging.debug(f"Event detected: {event_detection}")
         return jsonify({"status": "success", "message": "Confirmez-vous cet événement ?", "event": event_detection, "options": ["Confirmer", "Annuler"]})
     else:
@@ -570,28 +761,40 @@ def propose_event():
 
 
 
-@app.route('/confirm_event', methods=['POST'])
+def ensure_tu_form(event_detection):
+    # Assurer la cohérence dans la formulation
+    if not event_detection.startswith("Tu "):
+        event_detection = "Tu " + event_detection[0].lower() + event_detection[1:]
+    return event_detection
+
+
+
+
+@bp.route('/confirm_event', methods=['POST'])
 @jwt_required()
+@idempotent
 def confirm_event():
-    user_email = get_jwt_identity()
-    user = User.query.filter_by(email=user_email).first()
+    user_id = current_user_id()
     
-    if not user:
+    if user_id is None:
         return jsonify({"error": "User not found"}), 404
     
     confirmation = request.json.get('confirmation', '')
     event_description = request.json.get('event', '')
     
     if confirmation == "Confirmer":
-        response = save_event(user.id, event_description)
+        response = save_event(user_id, event_description)
         return jsonify({"status": "success", "message": response})
     else:
         return jsonify({"status": "cancelled", "message": "L'action a été annulée."})
 
 def save_event(user_id, description):
     logging.debug(f"Recording event for user_id: {user_id} with description: {description}")
-    new_event = PositiveEvent(user_id=user_id, description=description)
+    # Catégorie NULL quand le classifieur local hésite : classify-events la complétera
+    new_event = PositiveEvent(user_id=user_id, description=description, category=classify_event_locally(description))
     db.session.add(new_event)
+    db.session.flush()  # Pour obtenir l'id du nouvel événement avant la notification
+    record_change(user_id, 'created', new_event.id)
     db.session.commit()
     return "Événement enregistré avec succès."
 
@@ -600,19 +803,36 @@ def save_event(user_id, description):
 
 # ! EXTENSION 3 affichage de list ---------------
 
-@app.route('/get_actions', methods=['GET'])
+@bp.route('/get_actions', methods=['GET'])
 @jwt_required()
 def get_actions():
-    user_email = get_jwt_identity()
-    user = User.query.filter_by(email=user_email).first()
+    user_id = current_user_id()
+    zone = user_zone(current_user_timezone(user_id))
+    today = local_today(zone)
+
+    # Réponse en cache, sans aucune requête SQL : la date du jour fait partie de la clé,
+    # ce qui décale les groupes "Aujourd'hui"/"Hier" à minuit
+    cached = actions_cache.get(user_id, today) if user_id is not None else None
+    if cached is not None:
+        etag, body = cached
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        response = json_response(body)
+        response.set_etag(etag, weak=True)
+        return response
+
+    # Version lue avant la base : une écriture concurrente rendra l'entrée stockée plus bas aussitôt périmée
+    cache_version = actions_cache.version(user_id) if user_id is not None else None
+    user = db.session.get(User, user_id) if user_id is not None else None
     
     if not user:
         logging.error("User not found")
         return jsonify({"error": "User not found"}), 404
     
-    today = datetime.utcnow().date()
-    yesterday = today - timedelta(days=1)
-    day_before_yesterday = today - timedelta(days=2)
+    # Si rien n'a changé depuis la dernière lecture du client, on répond 304 sans interroger positive_event
+    etag = data_version_etag(user, today)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
     
     grouped_actions = {
         "Aujourd'hui": [],
@@ -620,29 +840,32 @@ def get_actions():
         "Avant-Hier": []
     }
     
-    events = PositiveEvent.query.filter(
+    # Une seule requête qui renvoie directement des tuples (id, description, groupe, isFavorite),
+    # sans construire d'objets PositiveEvent ni charger les favoris séparément. Les débuts de journée
+    # locaux sont convertis une fois en bornes UTC : c'est la base qui range chaque ligne dans son groupe.
+    day_before_yesterday_start, yesterday_start, today_start, tomorrow_start = day_bounds(zone, today - timedelta(days=2), 3)
+    bucket = case((PositiveEvent.date >= today_start, "Aujourd'hui"), (PositiveEvent.date >= yesterday_start, "Hier"), else_="Avant-Hier")
+    is_favorite = exists().where(Favorite.event_id == PositiveEvent.id, Favorite.user_id == user.id)
+    rows = db.session.query(PositiveEvent.id, PositiveEvent.description, bucket, is_favorite).filter(
         PositiveEvent.user_id == user.id,
-        PositiveEvent.date >= day_before_yesterday
+        PositiveEvent.date >= day_before_yesterday_start,
+        PositiveEvent.date < tomorrow_start,
+        PositiveEvent.deleted_at.is_(None)
     ).all()
 
-    # Obtenir les favoris de l'utilisateur
-    favorite_event_ids = {fav.event_id for fav in Favorite.query.filter_by(user_id=user.id).all()}
-    
-    for event in events:
-        event_date = event.date.date()
-        event_info = {
-            "id": event.id,
-            "description": event.description,
-            "isFavorite": event.id in favorite_event_ids  # Ajouter la propriété isFavorite
-        }
-        if (event_date == today):
-            grouped_actions["Aujourd'hui"].append(event_info)
-        elif (event_date == yesterday):
-            grouped_actions["Hier"].append(event_info)
-        elif (event_date == day_before_yesterday):
-            grouped_actions["Avant-Hier"].append(event_info)
+    for event_id, description, group, favorite in rows:
+        grouped_actions[group].append({
+            "id": event_id,
+            "description": description,
+            "isFavorite": bool(favorite)
+        })
     
-    return jsonify(grouped_actions)
+    body = dumps_json(grouped_actions)
+    if actions_cache.can_store():
+        actions_cache.put(user_id, cache_version, today, etag, body)
+    response = json_response(body)
+    response.set_etag(etag, weak=True)
+    return response
 
 
 
@@ -651,44 +874,48 @@ def get_actions():
 
 # ! ajout fonction d'édition sur list
 
-@app.route('/update_event/<int:event_id>', methods=['POST'])
+@bp.route('/update_event/<int:event_id>', methods=['POST'])
 @jwt_required()
+@idempotent
 def update_event(event_id):
-    user_email = get_jwt_identity()
-    user = User.query.filter_by(email=user_email).first()
-    if not user:
+    user_id = current_user_id()
+    if user_id is None:
         return jsonify({"error": "User not found"}), 404
 
-    event = PositiveEvent.query.filter_by(id=event_id, user_id=user.id).first()
+    event = PositiveEvent.query.filter_by(id=event_id, user_id=user_id, deleted_at=None).first()
     if not event:
         return jsonify({"error": "Event not found"}), 404
 
     new_description = request.json.get('description', None)
     if new_description:
         event.description = new_description
+        # Reclassé comme à l'enregistrement : NULL renvoie l'événement dans la file de classify-events
+        event.category = classify_event_locally(new_description)
+        record_change(user_id, 'updated', event.id)
         db.session.commit()
         return jsonify({"success": "Event updated"}), 200
     return jsonify({"error": "No description provided"}), 400
 
 
 
-@app.route('/delete_event/<int:event_id>', methods=['DELETE'])
+@bp.route('/delete_event/<int:event_id>', methods=['DELETE'])
 @jwt_required()
+@idempotent
 def delete_event(event_id):
-    user_email = get_jwt_identity()
-    user = User.query.filter_by(email=user_email).first()
-    if not user:
+    user_id = current_user_id()
+    if user_id is None:
         return jsonify({"error": "User not found"}), 404
 
-    event = PositiveEvent.query.filter_by(id=event_id, user_id=user.id).first()
-    if event:
-        # Supprimer d'abord toutes les entrées de favoris associées à cet événement
-        Favorite.query.filter_by(event_id=event.id).delete()
-
-        # Ensuite, supprimer l'événement lui-même
-        db.session.delete(event)
+    # Suppression logique : une seule mise à jour, annulable via /restore_event pendant EVENT_UNDO_WINDOW.
+    # L'événement et ses favoris sont effacés plus tard par la commande purge-deleted.
+    deleted_at = datetime.utcnow()
+    updated = PositiveEvent.query.filter_by(id=event_id, user_id=user_id, deleted_at=None).update(
+        {PositiveEvent.deleted_at: deleted_at}, synchronize_session=False
+    )
+    if updated:
+        record_change(user_id, 'deleted', event_id)
         db.session.commit()
-        return jsonify({"success": "Event deleted"}), 200
+        return jsonify({"success": "Event deleted", "undoUntil": (deleted_at + EVENT_UNDO_WINDOW).isoformat()}), 200
     return jsonify({"error": "Event not found"}), 404
 
 
@@ -707,45 +934,53 @@ def delete_event(event_id):
 class Favorite(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    event_id = db.Column(db.Integer, db.ForeignKey('positive_event.id'), nullable=False)
+    event_id = db.Column(db.Integer, db.ForeignKey('positive_event.id'), nullable=False, index=True)  # Contrainte absente en base sur PostgreSQL (table partitionnée)
     user = db.relationship('User', backref='favorites')
     event = db.relationship('PositiveEvent')
+    __table_args__ = (db.UniqueConstraint('user_id', 'event_id', name='uq_favorite_user_event'),)
 
 
-@app.route('/add_to_favorites/<int:event_id>', methods=['POST'])
+@bp.route('/add_to_favorites/<int:event_id>', methods=['POST'])
 @jwt_required()
+@idempotent
 def add_to_favorites(event_id):
-    user_email = get_jwt_identity()
-    user = User.query.filter_by(email=user_email).first()
-    if not user:
+    user_id = current_user_id()
+    if user_id is None:
         return jsonify({"error": "User not found"}), 404
 
-    event = PositiveEvent.query.filter_by(id=event_id).first()
+    event = PositiveEvent.query.filter_by(id=event_id, deleted_at=None).first()
     if not event:
         return jsonify({"error": "Event not found"}), 404
 
     # Vérifier si l'événement est déjà en favori
-    if Favorite.query.filter_by(user_id=user.id, event_id=event.id).first():
+    if Favorite.query.filter_by(user_id=user_id, event_id=event.id).first():
         return jsonify({"error": "Event already in favorites"}), 409
 
-    new_favorite = Favorite(user_id=user.id, event_id=event.id)
+    new_favorite = Favorite(user_id=user_id, event_id=event.id)
     db.session.add(new_favorite)
-    db.session.commit()
+    record_change(user_id, 'favorited', event.id)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Une requête concurrente vient d'ajouter le même favori
+        db.session.rollback()
+        return jsonify({"error": "Event already in favorites"}), 409
     return jsonify({"success": "Event added to favorites"}), 200
 
-@app.route('/remove_from_favorites/<int:event_id>', methods=['POST'])
+@bp.route('/remove_from_favorites/<int:event_id>', methods=['POST'])
 @jwt_required()
+@idempotent
 def remove_from_favorites(event_id):
-    user_email = get_jwt_identity()
-    user = User.query.filter_by(email=user_email).first()
-    if not user:
+    user_id = current_user_id()
+    if user_id is None:
         return jsonify({"error": "User not found"}), 404
 
-    favorite = Favorite.query.filter_by(user_id=user.id, event_id=event_id).first()
+    favorite = Favorite.query.filter_by(user_id=user_id, event_id=event_id).first()
     if not favorite:
         return jsonify({"error": "Favorite not found"}), 404
 
     db.session.delete(favorite)
+    record_change(user_id, 'unfavorited', event_id)
     db.session.commit()
     return jsonify({"success": "Favorite removed"}), 200
 
@@ -754,7 +989,7 @@ def remove_from_favorites(event_id):
 
 # ! EXTENSION 5 gestion token renouvellement ---------------
 
-@app.route('/check_session', methods=['GET'])
+@bp.route('/check_session', methods=['GET'])
 @jwt_required()
 def check_session():
     current_user = get_jwt_identity()
@@ -763,6 +998,2695 @@ def check_session():
 
 
 
+# ! EXTENSION 6 sérialisation des réponses ---------------
+
+COMPRESSION_MIN_SIZE = 1024  # En dessous, la compression coûte plus qu'elle ne rapporte
+
+
+def dumps_json(payload):
+    # Sérialise en JSON compact (bytes UTF-8), avec orjson quand il est disponible.
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    # Équivalent de jsonify pour les routes de lecture : JSON compact, compressé selon Accept-Encoding.
+    # `payload` peut être un JSON déjà sérialisé (bytes), par exemple lu dans un cache.
+    body = payload if isinstance(payload, bytes) else dumps_json(payload)
+    response = Response(body, status=status, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(body, quality=5))
+        response.content_encoding = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.content_encoding = 'gzip'
+    return response
+
+
+
+# ! EXTENSION 7 requêtes conditionnelles (ETag) ---------------
+
+def bump_data_version(user_id):
+    # Incrémente le compteur de version de l'utilisateur dans la transaction en cours.
+    # L'incrément est fait en SQL pour rester correct si plusieurs workers écrivent en même temps.
+    User.query.filter_by(id=user_id).update({User.data_version: User.data_version + 1}, synchronize_session=False)
+    # Le cache de /get_actions est invalidé au COMMIT (voir invalidate_cached_actions)
+    db.session.info.setdefault('changed_users', set()).add(user_id)
+
+
+def data_version_etag(user, *scope):
+    # Construit un ETag faible à partir de la version des données de l'utilisateur.
+    # `scope` permet d'y ajouter ce dont dépend la réponse en plus des données (date du jour, pagination...).
+    parts = [str(user.id), str(user.data_version)] + [str(part) for part in scope]
+    return "-".join(parts)
+
+
+def not_modified(etag):
+    response = make_response('', 304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def record_change(user_id, change_type, event_id):
+    # Point d'entrée unique des mutations : invalide les ETag et prévient les autres appareils.
+    bump_data_version(user_id)
+    publish_change(user_id, change_type, event_id)
+
+
+
+# ! EXTENSION 8 notifications en direct (SSE) ---------------
+
+CHANGES_CHANNEL = 'kokua_changes'
+SSE_KEEPALIVE_SECONDS = 15
+
+
+class ChangeBroker:
+    # Pub/sub en mémoire : chaque flux SSE ouvert possède sa file, indexée par utilisateur.
+    # Sur PostgreSQL, un thread unique par worker écoute LISTEN/NOTIFY et redistribue
+    # les notifications, ce qui propage les changements entre tous les workers gunicorn.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._listener = None
+        self._change_hooks = []
+        self._reconnect_hooks = []
+        self.listening = threading.Event()  # Posé quand LISTEN est actif : aucune notification n'est perdue
+
+    def add_hooks(self, on_change, on_reconnect):
+        # Appelés pour chaque changement reçu, et à chaque (re)connexion du thread d'écoute,
+        # puisque des notifications ont pu être manquées pendant la coupure.
+        self._change_hooks.append(on_change)
+        self._reconnect_hooks.append(on_reconnect)
+
+    def subscribe(self, user_id):
+        subscriber = queue.Queue(maxsize=100)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def dispatch(self, change):
+        for hook in self._change_hooks:
+            hook(change)
+        with self._lock:
+            subscribers = list(self._subscribers.get(change['user_id'], ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(change)
+            except queue.Full:
+                # Client trop lent : on abandonne la notification, il se resynchronisera via /get_actions
+                logger.warning("SSE subscriber queue full for user %s", change['user_id'])
+
+    def start_listener(self, engine):
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen, args=(engine,), name='change-listener', daemon=True)
+        self._listener.start()
+
+    def _listen(self, engine):
+        while True:
+            try:
+                # Connexion dédiée, détachée du pool pour ne pas lui retirer de place
+                raw = engine.raw_connection()
+                raw.detach()
+                connection = raw.driver_connection
+                connection.autocommit = True
+                connection.cursor().execute(f"LISTEN {CHANGES_CHANNEL}")
+                for hook in self._reconnect_hooks:
+                    hook()
+                self.listening.set()
+                while True:
+                    if select.select([connection], [], [], 60) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notification = connection.notifies.pop(0)
+                        self.dispatch(json.loads(notification.payload))
+            except Exception as e:
+                self.listening.clear()
+                logger.error(f"Change listener failed, reconnecting: {e}")
+                time.sleep(5)
+
+
+change_broker = ChangeBroker()
+
+
+def uses_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def publish_change(user_id, change_type, event_id):
+    # Publie un changement une fois la transaction en cours validée.
+    change = {"user_id": user_id, "type": change_type, "event_id": event_id}
+    if uses_postgres():
+        # pg_notify est transactionnel : la notification n'est émise qu'au COMMIT, vers tous les workers
+        db.session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANGES_CHANNEL, "payload": json.dumps(change)})
+    else:
+        db.session.info.setdefault('pending_changes', []).append(change)
+
+
+@sa_event.listens_for(db.session, 'after_commit')
+def dispatch_pending_changes(session):
+    for change in session.info.pop('pending_changes', []):
+        change_broker.dispatch(change)
+
+
+@sa_event.listens_for(db.session, 'after_rollback')
+def discard_pending_changes(session):
+    session.info.pop('pending_changes', None)
+
+
+@bp.route('/events/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])  # EventSource ne permet pas d'envoyer d'en-tête Authorization
+def events_stream():
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({"error": "User not found"}), 404
+
+    if uses_postgres():
+        change_broker.start_listener(db.engine)
+    # Libère la connexion SQL : le flux peut rester ouvert des heures sans occuper le pool
+    db.session.remove()
+
+    subscriber = change_broker.subscribe(user_id)
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    change = subscriber.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                payload = json.dumps({"id": change['event_id'], "type": change['type']})
+                yield f"event: {change['type']}\ndata: {payload}\n\n"
+        finally:
+            change_broker.unsubscribe(user_id, subscriber)
+
+    return Response(stream(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+
+# ! EXTENSION 9 export du journal ---------------
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FIELDS = ["id", "date", "description", "category", "isFavorite"]
+
+
+def iter_journal_rows(user_id):
+    # Parcourt tout le journal de l'utilisateur par lots, via un curseur côté serveur (yield_per),
+    # pour que la mémoire reste constante quel que soit le nombre d'événements.
+    is_favorite = exists().where(Favorite.event_id == PositiveEvent.id, Favorite.user_id == user_id)
+    query = db.session.query(
+        PositiveEvent.id, PositiveEvent.date, PositiveEvent.description, PositiveEvent.category, is_favorite
+    ).filter(PositiveEvent.user_id == user_id, PositiveEvent.deleted_at.is_(None)).order_by(PositiveEvent.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    for event_id, date, description, category, favorite in query:
+        yield event_id, date.isoformat() if date else None, description, category, bool(favorite)
+
+
+def iter_ndjson(rows):
+    batch = []
+    for row in rows:
+        batch.append(dumps_json(dict(zip(EXPORT_FIELDS, row))))
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield b"\n".join(batch) + b"\n"
+            batch = []
+    if batch:
+        yield b"\n".join(batch) + b"\n"
+
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_gzip(chunks):
+    # Compression gzip au fil de l'eau : chaque lot est compressé puis envoyé tel quel.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+@bp.route('/export_events', methods=['GET'])
+@jwt_required()
+def export_events():
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({"error": "User not found"}), 404
+
+    export_format = request.args.get('format', 'ndjson')
+    # Les partitions archivées (les plus anciennes) d'abord, puis les données en base
+    rows = itertools.chain(iter_archived_rows(user_id), iter_journal_rows(user_id))
+    if export_format == 'ndjson':
+        chunks, mimetype = iter_ndjson(rows), 'application/x-ndjson'
+    elif export_format == 'csv':
+        chunks, mimetype = iter_csv(rows), 'text/csv'
+    else:
+        return jsonify({"error": "Unsupported format, use 'ndjson' or 'csv'"}), 400
+
+    headers = {"Content-Disposition": f"attachment; filename=kokua-journal.{export_format}"}
+    if request.accept_encodings['gzip']:
+        chunks = iter_gzip(chunks)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+
+    # stream_with_context garde la session SQL ouverte pendant toute la durée du flux
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+
+# ! EXTENSION 10 import du journal ---------------
+
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_MAX_REPORTED_ERRORS = 100
+DESCRIPTION_MAX_LENGTH = 500
+CATEGORY_MAX_LENGTH = 100
+
+
+def iter_import_records(text_stream, import_format):
+    # Lit le fichier ligne par ligne et renvoie (numéro de ligne, dict) sans jamais le charger en entier.
+    if import_format == 'csv':
+        for line_number, record in enumerate(csv.DictReader(text_stream), 2):
+            yield line_number, record
+    else:
+        for line_number, line in enumerate(text_stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_number, record
+
+
+def import_text(record, field):
+    # Champ texte facultatif : les autres types JSON (nombre, liste...) sont rejetés, pas convertis
+    value = record.get(field)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be a string")
+    return value.strip()
+
+
+def validate_import_record(record, archived_months=frozenset()):
+    # Renvoie (description, catégorie, date) ou lève ValueError avec le motif du rejet.
+    if not isinstance(record, dict):
+        raise ValueError("Invalid JSON object")
+    description = import_text(record, 'description')
+    if not description:
+        raise ValueError("Missing description")
+    if len(description) > DESCRIPTION_MAX_LENGTH:
+        raise ValueError("Description too long")
+    category = import_text(record, 'category') or classify_event_locally(description)
+    if category and len(category) > CATEGORY_MAX_LENGTH:
+        raise ValueError("Category too long")
+    date = record.get('date')
+    if date:
+        from dateutil import parser  # Chargé seulement pour les imports de journal
+        try:
+            date = parser.isoparse(date)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid date")
+        if date.tzinfo is not None:
+            date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    else:
+        date = datetime.utcnow()
+    # La partition d'un mois archivé a été supprimée : la recréer masquerait l'archive de tous les
+    # utilisateurs pour ce mois, puis l'archivage suivant l'écraserait.
+    if month_start(date) in archived_months:
+        raise ValueError("Date falls in an archived month")
+    return description, category, date
+
+
+def load_import_chunk(user_id, chunk):
+    # Insère un lot dans sa propre transaction : COPY sur PostgreSQL, executemany ailleurs.
+    if uses_postgres():
+        ensure_event_partitions([date for description, category, date in chunk])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for description, category, date in chunk:
+            writer.writerow((user_id, description, category, date.isoformat()))
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert("COPY positive_event (user_id, description, category, date) FROM STDIN WITH (FORMAT csv)", buffer)
+    else:
+        db.session.execute(PositiveEvent.__table__.insert(), [
+            {"user_id": user_id, "description": description, "category": category, "date": date}
+            for description, category, date in chunk
+        ])
+    db.session.commit()
+
+
+def import_events(user_id, text_stream, import_format):
+    # Valide et charge un export NDJSON/CSV par lots de IMPORT_CHUNK_SIZE lignes, à mémoire bornée.
+    # Chaque lot est validé séparément : même si l'import s'interrompt en route, les lots déjà chargés
+    # sont signalés (version des données, caches, SSE) dans le `finally`.
+    imported, rejected, errors = 0, 0, []
+    chunk = []
+    archived = archived_months()
+    try:
+        for line_number, record in iter_import_records(text_stream, import_format):
+            try:
+                chunk.append(validate_import_record(record, archived))
+            except ValueError as e:
+                rejected += 1
+                if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+                    errors.append({"line": line_number, "error": str(e)})
+                continue
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                load_import_chunk(user_id, chunk)
+                imported += len(chunk)
+                chunk = []
+        if chunk:
+            load_import_chunk(user_id, chunk)
+            imported += len(chunk)
+    finally:
+        if imported:
+            db.session.rollback()
+            record_change(user_id, 'imported', None)
+            db.session.commit()
+    return {"imported": imported, "rejected": rejected, "errors": errors}
+
+
+def guess_import_format(filename, requested_format=None):
+    import_format = requested_format or ('csv' if (filename or '').lower().endswith('.csv') else 'ndjson')
+    if import_format not in ('ndjson', 'csv'):
+        raise ValueError("Unsupported format, use 'ndjson' or 'csv'")
+    return import_format
+
+
+@bp.route('/import_events', methods=['POST'])
+@jwt_required()
+@idempotent
+def import_events_route():
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({"error": "User not found"}), 404
+
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({"error": "No file provided"}), 400
+    try:
+        import_format = guess_import_format(upload.filename, request.args.get('format'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Werkzeug place les gros fichiers dans un fichier temporaire : la lecture se fait au fil de l'eau
+    text_stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    try:
+        result = import_events(user_id, text_stream, import_format)
+    except UnicodeDecodeError:
+        return jsonify({"error": "File must be UTF-8 encoded"}), 400
+    return jsonify(result), 200
+
+
+
+# ! EXTENSION 11 recherche plein texte ---------------
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+TRIGRAM_THRESHOLD = 0.3
+ARCHIVE_CURSOR_PREFIX = 'a'
+
+
+def search_terms(query):
+    return re.findall(r"\w+", query.lower())
+
+
+def encode_search_cursor(rank, event_id):
+    return f"{rank!r}_{event_id}"
+
+
+def decode_search_cursor(cursor):
+    rank, event_id = cursor.rsplit('_', 1)
+    return float(rank), int(event_id)
+
+
+def search_events_postgres(user_id, terms, limit, cursor):
+    # Requête plein texte sur la colonne générée search_vector (stemming français, index GIN).
+    # Chaque terme est cherché en préfixe ("vél" trouve "vélo") ; le tri (rang, id) permet la pagination par curseur.
+    tsquery = func.to_tsquery('french', " & ".join(f"{term}:*" for term in terms))
+    search_vector = column('search_vector')
+    rank = func.ts_rank_cd(search_vector, tsquery)
+    is_favorite = exists().where(Favorite.event_id == PositiveEvent.id, Favorite.user_id == user_id)
+    query = db.session.query(PositiveEvent.id, PositiveEvent.description, PositiveEvent.date, is_favorite, rank).filter(
+        PositiveEvent.user_id == user_id,
+        PositiveEvent.deleted_at.is_(None),
+        search_vector.op('@@')(tsquery)
+    )
+    if cursor:
+        cursor_rank, cursor_id = cursor
+        query = query.filter(tuple_(rank, PositiveEvent.id) < tuple_(cast(cursor_rank, REAL), cursor_id))
+    return query.order_by(rank.desc(), PositiveEvent.id.desc()).limit(limit).all()
+
+
+def normalize_for_search(value):
+    # Minuscules et sans accents, pour que "velo" trouve aussi "vélo"
+    decomposed = unicodedata.normalize('NFKD', value.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigram_rank(terms, description):
+    # Score proche de pg_trgm : 1 par terme trouvé en préfixe d'un mot, sinon la meilleure similarité trigramme.
+    words = search_terms(normalize_for_search(description))
+    if not words:
+        return 0.0
+    word_trigrams = [trigrams(word) for word in words]
+    score = 0.0
+    for term in terms:
+        if any(word.startswith(term) for word in words):
+            score += 1.0
+            continue
+        term_trigrams = trigrams(term)
+        similarity = max(len(term_trigrams & other) / len(term_trigrams | other) for other in word_trigrams)
+        if similarity < TRIGRAM_THRESHOLD:
+            return 0.0
+        score += similarity
+    return score / len(terms)
+
+
+def search_events_fallback(user_id, terms, limit, cursor):
+    # Repli en mémoire pour SQLite (tests, développement local) : même contrat que la version PostgreSQL.
+    terms = [normalize_for_search(term) for term in terms]
+    is_favorite = exists().where(Favorite.event_id == PositiveEvent.id, Favorite.user_id == user_id)
+    query = db.session.query(PositiveEvent.id, PositiveEvent.description, PositiveEvent.date, is_favorite).filter(
+        PositiveEvent.user_id == user_id,
+        PositiveEvent.deleted_at.is_(None)
+    ).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    matches = []
+    for event_id, description, date, favorite in query:
+        rank = trigram_rank(terms, description)
+        if rank > 0 and (cursor is None or (rank, event_id) < cursor):
+            matches.append((event_id, description, date, favorite, rank))
+    # Garde seulement la page demandée, sans trier tout l'historique
+    return heapq.nlargest(limit, matches, key=lambda row: (row[4], row[0]))
+
+
+@bp.route('/search_events', methods=['GET'])
+@jwt_required()
+def search_events():
+    user = db.session.get(User, current_user_id())
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+
+    terms = search_terms(request.args.get('q', ''))
+    if not terms:
+        return jsonify({"error": "Missing search query"}), 400
+    limit = min(request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int), SEARCH_MAX_LIMIT)
+    # Un curseur préfixé par ARCHIVE_CURSOR_PREFIX reprend dans les partitions archivées
+    raw_cursor = request.args.get('cursor', '')
+    in_archive = raw_cursor.startswith(ARCHIVE_CURSOR_PREFIX)
+    try:
+        cursor = decode_search_cursor(raw_cursor.removeprefix(ARCHIVE_CURSOR_PREFIX)) if raw_cursor else None
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    etag = data_version_etag(user, " ".join(terms), limit, raw_cursor)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    search = search_events_postgres if uses_postgres() else search_events_fallback
+    rows = [] if in_archive else search(user.id, terms, limit, cursor)
+    archived_rows = []
+    if len(rows) < limit:
+        # Résultats en base épuisés : la suite vient des archives de l'utilisateur
+        archived_rows = search_archived_events(user.id, terms, limit - len(rows), cursor if in_archive else None)
+        rows += archived_rows
+
+    results = [
+        {"id": event_id, "description": description, "date": date.isoformat(), "isFavorite": bool(favorite)}
+        for event_id, description, date, favorite, rank in rows
+    ]
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = (ARCHIVE_CURSOR_PREFIX if archived_rows else '') + encode_search_cursor(rows[-1][4], rows[-1][0])
+    response = json_response({"results": results, "next_cursor": next_cursor})
+    response.set_etag(etag, weak=True)
+    return response
+
+
+
+# ! EXTENSION 12 partitionnement et archivage de positive_event ---------------
+
+# Sur PostgreSQL, positive_event est partitionnée par mois sur `date` (migration c47a9e2f1d05).
+# Les partitions anciennes sont exportées vers un stockage objet durable (S3), un fichier CSV gzip par
+# utilisateur et par partition, puis supprimées. Export et recherche relisent les archives du seul
+# utilisateur concerné pour que l'historique reste complet.
+EVENT_ARCHIVE_BUCKET = os.getenv('EVENT_ARCHIVE_BUCKET')
+EVENT_ARCHIVE_PREFIX = os.getenv('EVENT_ARCHIVE_PREFIX', 'positive_event')
+# Répertoire local, pour le développement seulement : le disque d'un dyno Heroku disparaît avec lui
+EVENT_ARCHIVE_DIR = os.getenv('EVENT_ARCHIVE_DIR')
+PARTITION_MONTHS_AHEAD = 3
+PARTITION_ARCHIVE_AFTER_MONTHS = 24
+PARTITION_LOCK_TIMEOUT = '5s'
+PARTITION_NAME_PATTERN = re.compile(r"^positive_event_p(\d{4})_(\d{2})$")
+ARCHIVE_FIELDS = "id, user_id, description, category, date"
+
+
+def add_months(month, count):
+    years, month_index = divmod(month.month - 1 + count, 12)
+    return datetime(month.year + years, month_index + 1, 1)
+
+
+def month_start(date):
+    return datetime(date.year, date.month, 1)
+
+
+def partition_bounds(month):
+    return f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+
+
+def create_event_partition(month):
+    db.session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS positive_event_p{month:%Y_%m} PARTITION OF positive_event {partition_bounds(month)}"
+    ))
+
+
+def ensure_event_partitions(dates):
+    # Crée les partitions manquantes pour les mois de `dates` (import de dates anciennes par exemple).
+    if not uses_postgres():
+        return
+    for month in sorted({month_start(date) for date in dates}):
+        create_event_partition(month)
+
+
+def parse_partition_name(name):
+    match = PARTITION_NAME_PATTERN.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def list_event_partitions():
+    rows = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'positive_event'"
+    ))
+    partitions = [(parse_partition_name(name), name) for (name,) in rows]
+    return sorted(partition for partition in partitions if partition[0] is not None)
+
+
+def run_outside_transaction(statement):
+    # DETACH PARTITION ... CONCURRENTLY et FINALIZE refusent de tourner dans un bloc de transaction
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text(f"SET lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+        connection.execute(text(statement))
+
+
+def detach_event_partition(name):
+    # Sans CONCURRENTLY, le détachement prendrait ACCESS EXCLUSIVE sur positive_event et toutes les
+    # lectures de la table attendraient derrière les exports et imports en cours (PostgreSQL 14+).
+    run_outside_transaction(f"ALTER TABLE positive_event DETACH PARTITION {name} CONCURRENTLY")
+
+
+def attach_event_partition(name):
+    # ATTACH PARTITION ne prend que SHARE UPDATE EXCLUSIVE sur positive_event : lectures et écritures continuent
+    db.session.execute(text(f"ALTER TABLE positive_event ATTACH PARTITION {name} {partition_bounds(parse_partition_name(name))}"))
+    db.session.commit()
+
+
+def recover_detached_partitions(store):
+    # Reprend un archivage interrompu. Un détachement resté en attente est d'abord terminé ; une table
+    # détachée dont l'archive est complète (manifeste présent) est supprimée, les autres sont rattachées.
+    pending = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'positive_event'::regclass AND i.inhdetachpending"
+    )).scalars().all()
+    db.session.commit()
+    for name in pending:
+        run_outside_transaction(f"ALTER TABLE positive_event DETACH PARTITION {name} FINALIZE")
+
+    rows = db.session.execute(text(
+        "SELECT c.relname FROM pg_class c WHERE c.relkind = 'r' AND c.relname LIKE 'positive_event_p%' "
+        "AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)"
+    )).scalars().all()
+    db.session.commit()
+    archived = archived_partition_names(store) if store is not None else set()
+    recovered = []
+    for name in rows:
+        if parse_partition_name(name) is None:
+            continue
+        if name in archived:
+            db.session.execute(text(f"DROP TABLE {name}"))
+            db.session.commit()
+            logger.warning("Dropped detached partition %s, already archived", name)
+        else:
+            attach_event_partition(name)
+            logger.warning("Reattached detached partition %s", name)
+        recovered.append(name)
+    return recovered
+
+
+class S3ArchiveStore:
+    def __init__(self, bucket, prefix):
+        import boto3  # Chargé seulement pour l'archivage et la relecture des archives
+        self.client = boto3.client('s3')
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def describe(self, key):
+        return f"s3://{self.bucket}/{self.prefix}/{key}"
+
+    def put(self, key, body):
+        # S3 recalcule le SHA-256 à la réception et refuse l'objet s'il diffère ; la relecture des
+        # métadonnées confirme ensuite que c'est bien cet objet-là qui est stocké.
+        checksum = base64.b64encode(hashlib.sha256(body).digest()).decode()
+        self.client.put_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}", Body=body, ChecksumSHA256=checksum)
+        head = self.client.head_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}", ChecksumMode='ENABLED')
+        if head.get('ChecksumSHA256') != checksum or head['ContentLength'] != len(body):
+            raise RuntimeError(f"Archive upload of {key} could not be verified")
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}")['Body'].read()
+
+    def list(self, prefix):
+        keys = []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=f"{self.prefix}/{prefix}"):
+            keys.extend(item['Key'][len(self.prefix) + 1:] for item in page.get('Contents', []))
+        return sorted(keys)
+
+    def delete(self, keys):
+        for start in range(0, len(keys), 1000):
+            objects = [{'Key': f"{self.prefix}/{key}"} for key in keys[start:start + 1000]]
+            self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects})
+
+
+class LocalArchiveStore:
+    # Même interface que S3ArchiveStore, sur disque
+    def __init__(self, directory):
+        self.directory = directory
+
+    def describe(self, key):
+        return os.path.join(self.directory, key)
+
+    def put(self, key, body):
+        path = self.describe(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", 'wb') as file:
+            file.write(body)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f"{path}.tmp", path)
+        if hashlib.sha256(self.get(key)).digest() != hashlib.sha256(body).digest():
+            raise RuntimeError(f"Archive write of {key} could not be verified")
+
+    def get(self, key):
+        with open(self.describe(key), 'rb') as file:
+            return file.read()
+
+    def list(self, prefix):
+        base = self.describe(prefix)
+        if not os.path.isdir(base):
+            return []
+        return sorted(os.path.join(prefix, name) for name in os.listdir(base) if not name.endswith('.tmp'))
+
+    def delete(self, keys):
+        for key in keys:
+            if os.path.exists(self.describe(key)):
+                os.remove(self.describe(key))
+
+
+_archive_store = None
+
+
+def archive_store():
+    # Stockage des partitions archivées, ou None si aucun n'est configuré (rien n'est alors archivé).
+    global _archive_store
+    if _archive_store is None:
+        if EVENT_ARCHIVE_BUCKET:
+            _archive_store = S3ArchiveStore(EVENT_ARCHIVE_BUCKET, EVENT_ARCHIVE_PREFIX)
+        elif EVENT_ARCHIVE_DIR:
+            _archive_store = LocalArchiveStore(EVENT_ARCHIVE_DIR)
+    return _archive_store
+
+
+def user_archive_key(user_id, name):
+    return f"users/{user_id}/{name}.csv.gz"
+
+
+def manifest_key(name):
+    return f"partitions/{name}.json"
+
+
+def archived_partition_names(store):
+    # Partitions dont l'archive est complète : le manifeste est écrit en dernier
+    return {key[len('partitions/'):-len('.json')] for key in store.list('partitions/') if key.endswith('.json')}
+
+
+def archived_months():
+    # Mois dont la partition a été archivée, où plus aucune ligne ne doit être écrite en base.
+    store = archive_store()
+    if store is None:
+        return frozenset()
+    return frozenset(month for month in map(parse_partition_name, archived_partition_names(store)) if month is not None)
+
+
+def iter_partition_user_archives(name):
+    # Exporte la partition triée par utilisateur dans un fichier temporaire, puis la découpe en un
+    # CSV gzip par utilisateur : un seul utilisateur à la fois en mémoire.
+    with tempfile.TemporaryFile() as spool:
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            f"COPY (SELECT {ARCHIVE_FIELDS} FROM {name} WHERE deleted_at IS NULL ORDER BY user_id, id) TO STDOUT WITH (FORMAT csv)",
+            spool
+        )
+        spool.seek(0)
+        reader = csv.reader(io.TextIOWrapper(spool, encoding='utf-8', newline=''))
+        for user_id, rows in itertools.groupby(reader, key=lambda row: int(row[1])):
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            count = 0
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+            yield user_id, gzip.compress(buffer.getvalue().encode('utf-8')), count
+
+
+def archive_event_partition(name, store):
+    # La partition est d'abord détachée sans bloquer positive_event : plus personne n'y écrit pendant
+    # l'export, et ses lignes disparaissent des lectures jusqu'à l'écriture du manifeste. Tout échec
+    # (export, envoi, vérification) supprime les objets envoyés et rattache la partition.
+    if name in archived_partition_names(store):
+        # Jamais d'écrasement : l'archive existante peut contenir des lignes absentes de la partition
+        raise RuntimeError(f"{name} is already archived at {store.describe(manifest_key(name))}")
+    detach_event_partition(name)
+    uploaded = []
+    try:
+        expected = db.session.execute(text(f"SELECT count(*) FROM {name} WHERE deleted_at IS NULL")).scalar()
+        users = {}
+        for user_id, body, count in iter_partition_user_archives(name):
+            key = user_archive_key(user_id, name)
+            store.put(key, body)
+            uploaded.append(key)
+            users[str(user_id)] = {"rows": count, "sha256": hashlib.sha256(body).hexdigest()}
+        archived = sum(user["rows"] for user in users.values())
+        if archived != expected:
+            raise RuntimeError(f"Archive of {name} incomplete: {archived} rows written, {expected} expected")
+
+        # Le manifeste, écrit en dernier, marque l'archive comme complète
+        manifest = {"partition": name, "rows": archived, "users": users, "archivedAt": datetime.utcnow().isoformat()}
+        store.put(manifest_key(name), json.dumps(manifest).encode('utf-8'))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        try:
+            store.delete(uploaded)
+        except Exception as e:
+            logger.error(f"Cleanup of partial archive {name} failed: {e}")
+        try:
+            attach_event_partition(name)
+        except Exception as e:
+            # recover_detached_partitions() la rattachera au prochain passage
+            logger.error(f"Reattaching {name} failed: {e}")
+        raise
+
+    # Le DROP ne verrouille plus que la table détachée ; s'il échoue, recover_detached_partitions()
+    # la supprimera au prochain passage puisque son manifeste existe.
+    db.session.execute(text(f"DROP TABLE {name}"))
+    db.session.commit()
+    return store.describe(manifest_key(name)), archived
+
+
+def maintain_event_partitions(months_ahead=PARTITION_MONTHS_AHEAD, archive_after_months=PARTITION_ARCHIVE_AFTER_MONTHS):
+    store = archive_store()
+    recover_detached_partitions(store)
+    current = month_start(datetime.utcnow())
+    ensure_event_partitions([add_months(current, offset) for offset in range(months_ahead + 1)])
+    db.session.commit()
+
+    cutoff = add_months(current, -archive_after_months)
+    expired = [name for month, name in list_event_partitions() if month < cutoff]
+    if not expired:
+        return []
+    if store is None or (isinstance(store, LocalArchiveStore) and os.getenv('DYNO')):
+        logger.warning("No durable archive store (EVENT_ARCHIVE_BUCKET), %s partitions kept", len(expired))
+        return []
+    return [archive_event_partition(name, store) for name in expired]
+
+
+def archived_partitions(store, names):
+    # Partitions dont l'archive est complète (manifeste présent) et qui ne sont plus en base : une partition
+    # encore présente (DROP annulé après l'écriture du manifeste) est lue en base, jamais deux fois.
+    complete = archived_partition_names(store)
+    names = [name for name in names if name in complete]
+    if names and uses_postgres():
+        present = set(db.session.execute(
+            text("SELECT name FROM unnest(CAST(:names AS text[])) AS name WHERE to_regclass(name) IS NOT NULL"),
+            {"names": names}
+        ).scalars())
+        names = [name for name in names if name not in present]
+    return names
+
+
+def iter_archived_events(user_id):
+    # Lignes archivées de l'utilisateur, des plus anciennes aux plus récentes : (id, date, description, catégorie).
+    # Seuls les objets de l'utilisateur sont listés et lus, quel que soit le volume total archivé.
+    store = archive_store()
+    if store is None:
+        return
+    keys = {key.rsplit('/', 1)[1][:-len('.csv.gz')]: key for key in store.list(f"users/{user_id}/") if key.endswith('.csv.gz')}
+    for name in sorted(archived_partitions(store, list(keys))):
+        with gzip.open(io.BytesIO(store.get(keys[name])), 'rt', encoding='utf-8', newline='') as archive:
+            for event_id, row_user_id, description, category, date in csv.reader(archive):
+                yield int(event_id), datetime.fromisoformat(date), description, category or None
+
+
+def iter_archived_rows(user_id):
+    # Relit les partitions archivées de l'utilisateur, au même format que iter_journal_rows.
+    favorite_event_ids = None
+    for event_id, date, description, category in iter_archived_events(user_id):
+        if favorite_event_ids is None:
+            favorite_event_ids = {event_id for (event_id,) in db.session.query(Favorite.event_id).filter_by(user_id=user_id)}
+        yield event_id, date.isoformat(), description, category, event_id in favorite_event_ids
+
+
+def search_archived_events(user_id, terms, limit, cursor):
+    # Recherche dans les partitions archivées de l'utilisateur : même contrat et même score que
+    # search_events_fallback, les favoris n'étant lus que pour la page renvoyée.
+    terms = [normalize_for_search(term) for term in terms]
+    matches = []
+    for event_id, date, description, category in iter_archived_events(user_id):
+        rank = trigram_rank(terms, description)
+        if rank > 0 and (cursor is None or (rank, event_id) < cursor):
+            matches.append((event_id, description, date, rank))
+    page = heapq.nlargest(limit, matches, key=lambda row: (row[3], row[0]))
+    favorite_event_ids = {event_id for (event_id,) in db.session.query(Favorite.event_id).filter(
+        Favorite.user_id == user_id, Favorite.event_id.in_([row[0] for row in page])
+    )} if page else set()
+    return [(event_id, description, date, event_id in favorite_event_ids, rank) for event_id, description, date, rank in page]
+
+
+@bp.cli.command('maintain-partitions')
+@click.option('--months-ahead', default=PARTITION_MONTHS_AHEAD, help="Nombre de partitions futures à créer.")
+@click.option('--archive-after', default=PARTITION_ARCHIVE_AFTER_MONTHS, help="Âge en mois au-delà duquel une partition est archivée.")
+def maintain_partitions_command(months_ahead, archive_after):
+    # À lancer chaque jour (Heroku Scheduler) : flask --app kokuahuane maintain-partitions
+    if not uses_postgres():
+        click.echo("Partitioning is only available on PostgreSQL.")
+        return
+    for location, count in maintain_event_partitions(months_ahead, archive_after):
+        click.echo(f"Archived {count} rows to {location}")
+
+
+
+# ! EXTENSION 13 mémoire des reformulations "Tu ..." ---------------
+
+# Les reformulations de `record` sont partagées entre utilisateurs : la clé est une empreinte
+# de la phrase normalisée, sans lien avec l'utilisateur. Les phrases longues ou contenant des
+# données personnelles évidentes (email, téléphone, lien) ne sont jamais mémorisées.
+REWRITE_MAX_INPUT_LENGTH = 120
+REWRITE_MEMORY_SIZE = 5000
+REWRITE_WARM_SIZE = 1000
+REWRITE_HITS_FLUSH_SECONDS = 60
+PERSONAL_DATA_PATTERN = re.compile(r"\S+@\S+|https?://|www\.|\+?\d[\d .-]{7,}\d")
+
+
+class EventRewrite(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    input_hash = db.Column(db.String(64), unique=True, nullable=False)
+    rewrite = db.Column(db.String(500), nullable=False)
+    hit_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class RewriteStore:
+    # Cache mémoire (LRU) devant la table event_rewrite, préchargé avec les reformulations les plus utilisées :
+    # dans le master gunicorn avant le fork (when_ready), sinon au premier appel.
+    # Les compteurs de hits sont cumulés en mémoire et écrits en base au plus une fois par minute.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._pending_hits = Counter()
+        self._last_flush = time.monotonic()
+        self._warmed = False
+
+    def _remember(self, input_hash, rewrite):
+        self._memory[input_hash] = rewrite
+        self._memory.move_to_end(input_hash)
+        if len(self._memory) > REWRITE_MEMORY_SIZE:
+            self._memory.popitem(last=False)
+
+    def warm(self):
+        rows = db.session.query(EventRewrite.input_hash, EventRewrite.rewrite).order_by(
+            EventRewrite.hit_count.desc()
+        ).limit(REWRITE_WARM_SIZE).all()
+        with self._lock:
+            for input_hash, rewrite in reversed(rows):
+                self._remember(input_hash, rewrite)
+            self._warmed = True
+
+    def get(self, input_hash):
+        if not self._warmed:
+            self.warm()
+        with self._lock:
+            rewrite = self._memory.get(input_hash)
+            if rewrite is not None:
+                self._memory.move_to_end(input_hash)
+        if rewrite is None:
+            rewrite = db.session.query(EventRewrite.rewrite).filter_by(input_hash=input_hash).scalar()
+            if rewrite is None:
+                return None
+            with self._lock:
+                self._remember(input_hash, rewrite)
+        self._count_hit(input_hash)
+        return rewrite
+
+    def put(self, input_hash, rewrite):
+        # Connexion à part : rien n'est validé ni annulé dans la session de la requête appelante
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(EventRewrite.__table__.insert(), {
+                    "input_hash": input_hash, "rewrite": rewrite, "hit_count": 0, "created_at": datetime.utcnow()
+                })
+        except IntegrityError:
+            pass  # Un autre worker vient d'enregistrer la même phrase
+        with self._lock:
+            self._remember(input_hash, rewrite)
+
+    def _count_hit(self, input_hash):
+        with self._lock:
+            self._pending_hits[input_hash] += 1
+            if time.monotonic() - self._last_flush < REWRITE_HITS_FLUSH_SECONDS:
+                return
+            pending, self._pending_hits = self._pending_hits, Counter()
+            self._last_flush = time.monotonic()
+        self.flush_hits(pending)
+
+    def flush_hits(self, pending):
+        # Une seule mise à jour groupée, sur sa propre connexion et dans sa propre transaction
+        table = EventRewrite.__table__
+        statement = table.update().where(table.c.input_hash == bindparam('key')).values(
+            hit_count=table.c.hit_count + bindparam('hits')
+        )
+        with db.engine.begin() as connection:
+            connection.execute(statement, [{"key": input_hash, "hits": hits} for input_hash, hits in pending.items()])
+
+
+rewrite_store = RewriteStore()
+
+
+def rewrite_key(user_input):
+    # Normalise la phrase (casse, espaces, ponctuation finale) puis en calcule l'empreinte.
+    # Renvoie None si la phrase ne doit pas être mémorisée.
+    normalized = unicodedata.normalize('NFC', " ".join(user_input.lower().split())).replace("’", "'").strip(" .!?…")
+    if not normalized or len(normalized) > REWRITE_MAX_INPUT_LENGTH or PERSONAL_DATA_PATTERN.search(normalized):
+        return None
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def lookup_rewrite(user_input):
+    input_hash = rewrite_key(user_input)
+    if input_hash is None:
+        return None
+    return rewrite_store.get(input_hash)
+
+
+def store_rewrite(user_input, rewrite):
+    input_hash = rewrite_key(user_input)
+    if input_hash is not None and len(rewrite) <= 500:
+        rewrite_store.put(input_hash, rewrite)
+
+
+
+# ! EXTENSION 14 récapitulatifs hebdomadaires et mensuels ---------------
+
+# Les récapitulatifs sont calculés hors ligne (flask compute-summaries, lancé la nuit par le scheduler)
+# avec la configuration `recall`, puis servis tels quels par /summaries.
+SUMMARY_PERIODS = ('week', 'month')
+SUMMARY_CONCURRENCY = 4
+SUMMARY_BATCH_SIZE = 100
+SUMMARY_LIST_LIMIT = 12
+
+
+class EventSummary(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    period = db.Column(db.String(10), nullable=False)  # 'week' ou 'month'
+    period_start = db.Column(db.Date, nullable=False)
+    summary = db.Column(db.Text, nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # Empreinte des événements résumés
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('user_id', 'period', 'period_start'),)
+
+
+def period_bounds(period, day):
+    # Renvoie (début, fin exclue) de la semaine (lundi) ou du mois contenant `day`.
+    if period == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    start = day.replace(day=1)
+    return start, add_months(start, 1).date()
+
+
+def summary_zones():
+    # Fuseaux des utilisateurs, regroupés par zone effective : {zone: [noms de User.timezone]}.
+    zones = {}
+    for (name,) in db.session.query(User.timezone).distinct():
+        zones.setdefault(user_zone(name), []).append(name)
+    return zones
+
+
+def summary_jobs(period, start, zone, timezone_names, batch_size=SUMMARY_BATCH_SIZE):
+    # Renvoie les tâches par lots de `batch_size` utilisateurs, parcourus par clé (user_id > dernier vu).
+    # Chaque lot est lu entièrement avant d'être rendu : les commits de save_summaries entre deux lots
+    # n'invalident aucun curseur encore ouvert (un curseur nommé psycopg2 ne survit pas au COMMIT).
+    # Seuls les utilisateurs dont l'empreinte (fuseau compris) a changé ont une tâche.
+    # La période va de minuit à minuit dans le fuseau `zone`, comme les journées de /get_actions.
+    _, end = period_bounds(period, start)
+    bounds = day_bounds(zone, start, (end - start).days)
+    in_period = (PositiveEvent.date >= bounds[0], PositiveEvent.date < bounds[-1], PositiveEvent.deleted_at.is_(None))
+    in_zone = PositiveEvent.user_id.in_(db.select(User.id).where(User.timezone.in_(timezone_names)))
+    after = 0
+    while True:
+        user_ids = [user_id for (user_id,) in db.session.query(PositiveEvent.user_id).filter(
+            *in_period, in_zone, PositiveEvent.user_id > after
+        ).distinct().order_by(PositiveEvent.user_id).limit(batch_size)]
+        if not user_ids:
+            return
+        after = user_ids[-1]
+
+        known = dict(db.session.query(EventSummary.user_id, EventSummary.fingerprint).filter(
+            EventSummary.period == period, EventSummary.period_start == start, EventSummary.user_id.in_(user_ids)
+        ))
+        rows = db.session.query(PositiveEvent.user_id, PositiveEvent.date, PositiveEvent.description).filter(
+            *in_period, PositiveEvent.user_id.in_(user_ids)
+        ).order_by(PositiveEvent.user_id, PositiveEvent.date, PositiveEvent.id).all()
+        batch = []
+        for user_id, events in itertools.groupby(rows, key=lambda row: row[0]):
+            prompt = "\n".join(
+                f"- {date.replace(tzinfo=timezone.utc).astimezone(zone):%Y-%m-%d} : {description}" for _, date, description in events
+            )
+            fingerprint = hashlib.sha256(f"{zone.key}\n{prompt}".encode('utf-8')).hexdigest()
+            if known.get(user_id) != fingerprint:
+                batch.append((user_id, fingerprint, prompt))
+        yield batch
+
+
+def save_summaries(period, start, results):
+    existing = {summary.user_id: summary for summary in EventSummary.query.filter(
+        EventSummary.period == period,
+        EventSummary.period_start == start,
+        EventSummary.user_id.in_([user_id for user_id, _, _ in results])
+    )}
+    for user_id, fingerprint, summary in results:
+        row = existing.get(user_id) or EventSummary(user_id=user_id, period=period, period_start=start)
+        row.summary, row.fingerprint = summary, fingerprint
+        db.session.add(row)
+    db.session.commit()
+
+
+def compute_summaries(period, concurrency=SUMMARY_CONCURRENCY, batch_size=SUMMARY_BATCH_SIZE):
+    # Recalcule, dans le fuseau de chaque utilisateur, la période précédente (qui vient de se terminer)
+    # et la période en cours.
+    periods = []
+    for zone, timezone_names in summary_zones().items():
+        current_start, _ = period_bounds(period, local_today(zone))
+        previous_start, _ = period_bounds(period, current_start - timedelta(days=1))
+        periods.extend((start, zone, timezone_names) for start in (previous_start, current_start))
+    computed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for start, zone, timezone_names in periods:
+            for batch in summary_jobs(period, start, zone, timezone_names, batch_size):
+                if not batch:
+                    continue
+                summaries = executor.map(with_app_context(lambda job: ask_gpt_mood(job[2], "recall")), batch)
+                # Un échec de l'API laisse l'ancienne version en place : elle sera retentée au prochain passage
+                results = [(user_id, fingerprint, summary) for (user_id, fingerprint, _), summary in zip(batch, summaries) if summary]
+                save_summaries(period, start, results)
+                computed += len(results)
+    return computed
+
+
+@bp.cli.command('compute-summaries')
+@click.option('--period', type=click.Choice(SUMMARY_PERIODS), multiple=True, help="Période(s) à calculer, toutes par défaut.")
+@click.option('--concurrency', default=SUMMARY_CONCURRENCY, help="Nombre maximal d'appels simultanés à l'API.")
+@click.option('--batch-size', default=SUMMARY_BATCH_SIZE, help="Nombre d'utilisateurs traités (et enregistrés) par lot.")
+def compute_summaries_command(period, concurrency, batch_size):
+    # À lancer en heures creuses (Heroku Scheduler) : flask --app kokuahuane compute-summaries
+    for name in period or SUMMARY_PERIODS:
+        click.echo(f"{name}: {compute_summaries(name, concurrency, batch_size)} summaries updated")
+
+
+@bp.route('/summaries', methods=['GET'])
+@jwt_required()
+def list_summaries():
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({"error": "User not found"}), 404
+
+    period = request.args.get('period', 'week')
+    if period not in SUMMARY_PERIODS:
+        return jsonify({"error": "Unsupported period, use 'week' or 'month'"}), 400
+
+    rows = db.session.query(EventSummary.period_start, EventSummary.summary, EventSummary.updated_at).filter_by(
+        user_id=user_id, period=period
+    ).order_by(EventSummary.period_start.desc()).limit(SUMMARY_LIST_LIMIT).all()
+    return json_response([
+        {"periodStart": period_start.isoformat(), "summary": summary, "updatedAt": updated_at.isoformat()}
+        for period_start, summary, updated_at in rows
+    ])
+
+
+
+
+# ! EXTENSION 15 cache partagé entre workers ---------------
+
+# Avec preload_app, ce module est importé dans le master gunicorn avant le fork : la zone mmap
+# anonyme et le verrou créés ici sont donc partagés par tous les workers. Chaque worker lit et
+# complète la même table au lieu de refaire ses propres requêtes.
+GPT_CONFIG_PATH = 'gpt_config.json'
+GPT_CONFIG_CHECK_SECONDS = 5
+USER_ID_CACHE_SLOTS = 1 << 17
+USER_ID_CACHE_MAX_PROBES = 16
+USER_ID_WARM_SIZE = 10000
+
+
+class SharedLookupTable:
+    # Table de hachage à adressage ouvert dans une mmap partagée : empreinte de 16 octets -> entier.
+    # L'en-tête contient deux compteurs de version (configuration, table) qui servent de canal
+    # d'invalidation entre workers.
+    HEADER = struct.Struct('<QQ')
+    SLOT = struct.Struct('<16sq')
+    EMPTY = bytes(16)
+
+    def __init__(self, slots, epoch=0):
+        self.slots = slots
+        self._map = mmap.mmap(-1, self.HEADER.size + slots * self.SLOT.size)
+        self._lock = multiprocessing.Lock()
+        self.HEADER.pack_into(self._map, 0, 0, epoch)
+
+    def _slot_offset(self, index):
+        return self.HEADER.size + index * self.SLOT.size
+
+    def _probe(self, digest):
+        start = int.from_bytes(digest[:8], 'little') % self.slots
+        for step in range(USER_ID_CACHE_MAX_PROBES):
+            index = (start + step) % self.slots
+            yield self._slot_offset(index)
+
+    def get(self, digest):
+        with self._lock:
+            for offset in self._probe(digest):
+                key, value = self.SLOT.unpack_from(self._map, offset)
+                if key == digest:
+                    return value
+                if key == self.EMPTY:
+                    return None
+        return None
+
+    def put(self, digest, value):
+        with self._lock:
+            for offset in self._probe(digest):
+                key, _ = self.SLOT.unpack_from(self._map, offset)
+                if key in (digest, self.EMPTY):
+                    self.SLOT.pack_into(self._map, offset, digest, value)
+                    return True
+        # Zone saturée autour de cette empreinte : on se passe du cache pour cette clé
+        return False
+
+    def increment(self, digest):
+        # Incrément atomique entre workers ; une clé absente part de 0
+        with self._lock:
+            for offset in self._probe(digest):
+                key, value = self.SLOT.unpack_from(self._map, offset)
+                if key in (digest, self.EMPTY):
+                    self.SLOT.pack_into(self._map, offset, digest, value + 1 if key == digest else 1)
+                    return True
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._map[self.HEADER.size:] = bytes(len(self._map) - self.HEADER.size)
+            config_version, table_version = self.HEADER.unpack_from(self._map, 0)
+            self.HEADER.pack_into(self._map, 0, config_version, table_version + 1)
+
+    def config_version(self):
+        return self.HEADER.unpack_from(self._map, 0)[0]
+
+    def table_version(self):
+        return self.HEADER.unpack_from(self._map, 0)[1]
+
+    def bump_config_version(self):
+        with self._lock:
+            config_version, table_version = self.HEADER.unpack_from(self._map, 0)
+            self.HEADER.pack_into(self._map, 0, config_version + 1, table_version)
+
+
+shared_table = SharedLookupTable(USER_ID_CACHE_SLOTS)
+
+
+def email_digest(email):
+    return hashlib.blake2b(email.encode('utf-8'), digest_size=16).digest()
+
+
+def current_user_id():
+    # Id de l'utilisateur du JWT courant, sans requête SQL quand il est déjà dans la table partagée.
+    # L'association email -> id ne change jamais : une entrée ne devient fausse que si l'utilisateur
+    # est supprimé, auquel cas il faut appeler shared_table.clear().
+    user_id = get_jwt().get('uid')
+    if user_id is not None:
+        return user_id
+    # Jetons émis avant l'ajout de la revendication uid
+    email = get_jwt_identity()
+    digest = email_digest(email)
+    user_id = shared_table.get(digest)
+    if user_id is None:
+        user_id = db.session.query(User.id).filter_by(email=email).scalar()
+        if user_id is not None:
+            shared_table.put(digest, user_id)
+    return user_id
+
+
+def warm_user_ids(limit=USER_ID_WARM_SIZE):
+    # Précharge les utilisateurs actifs récemment ; appelé dans le master gunicorn avant le fork.
+    since = datetime.utcnow() - timedelta(days=7)
+    active = db.session.query(PositiveEvent.user_id).filter(PositiveEvent.date >= since).distinct().subquery()
+    rows = db.session.query(User.email, User.id).filter(User.id.in_(db.select(active.c.user_id))).limit(limit)
+    count = 0
+    for email, user_id in rows:
+        count += shared_table.put(email_digest(email), user_id)
+    return count
+
+
+_gpt_config = {"data": None, "version": None, "mtime": None, "checked_at": 0.0}
+
+
+def gpt_config(config_type):
+    # Configuration GPT parsée une seule fois (dans le master avec preload_app), puis rechargée
+    # quand gpt_config.json change. Le worker qui détecte la modification incrémente la version
+    # partagée, ce qui fait recharger les autres workers sans qu'ils aient à surveiller le fichier.
+    now = time.monotonic()
+    if now - _gpt_config["checked_at"] > GPT_CONFIG_CHECK_SECONDS:
+        _gpt_config["checked_at"] = now
+        mtime = os.stat(GPT_CONFIG_PATH).st_mtime
+        if _gpt_config["mtime"] is not None and mtime != _gpt_config["mtime"]:
+            shared_table.bump_config_version()
+        _gpt_config["mtime"] = mtime
+
+    version = shared_table.config_version()
+    if _gpt_config["data"] is None or _gpt_config["version"] != version:
+        with open(GPT_CONFIG_PATH, 'r') as file:
+            _gpt_config["data"] = json.load(file)
+        _gpt_config["version"] = version
+    return _gpt_config["data"][config_type]
+
+
+
+# ! EXTENSION 16 routage des modèles selon latence et coût ---------------
+
+# Une configuration de gpt_config.json peut déclarer `candidates` (modèles alternatifs) et `latency_slo_ms`.
+# Le routeur sert le modèle le moins cher qui respecte le SLO, dont le taux d'erreur est acceptable et dont
+# les réponses concordent avec celles du modèle principal (`model`), mesuré par évaluation fantôme :
+# une petite part des appels est rejouée en arrière-plan sur un autre modèle, sans effet pour l'utilisateur.
+ROUTER_WINDOW = 200
+ROUTER_MIN_SAMPLES = 20
+ROUTER_MAX_ERROR_RATE = 0.05
+ROUTER_MIN_AGREEMENT = 0.8
+ROUTER_SHADOW_RATE = 0.05
+ROUTER_SIMILARITY_THRESHOLD = 0.6
+
+# Prix en dollars par million de tokens (entrée, sortie)
+MODEL_PRICES = {
+    'gpt-4': (30.0, 60.0),
+    'gpt-4-turbo': (10.0, 30.0),
+    'gpt-4o': (5.0, 15.0),
+    'gpt-4o-mini': (0.15, 0.6),
+}
+
+
+class ModelStats:
+    def __init__(self):
+        self.latencies = deque(maxlen=ROUTER_WINDOW)
+        self.errors = deque(maxlen=ROUTER_WINDOW)
+        self.agreements = deque(maxlen=ROUTER_WINDOW)
+        self.cost = 0.0
+
+    def p95_latency_ms(self):
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95)] if ordered else None
+
+    def error_rate(self):
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+    def agreement_rate(self):
+        return sum(self.agreements) / len(self.agreements) if self.agreements else None
+
+
+def model_cost(model, usage):
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (usage.get('prompt_tokens', 0) * input_price + usage.get('completion_tokens', 0) * output_price) / 1_000_000
+
+
+def answers_agree(answer, reference):
+    # Concordance approchée : mêmes mots à ROUTER_SIMILARITY_THRESHOLD près (Jaccard), casse et accents ignorés
+    words, reference_words = set(search_terms(normalize_for_search(answer))), set(search_terms(normalize_for_search(reference)))
+    if not words and not reference_words:
+        return True
+    return len(words & reference_words) / len(words | reference_words) >= ROUTER_SIMILARITY_THRESHOLD
+
+
+class ModelRouter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def stats(self, config_type, model):
+        with self._lock:
+            return self._stats.setdefault((config_type, model), ModelStats())
+
+    def _meets_slo(self, config_type, model, config, primary):
+        stats = self.stats(config_type, model)
+        if len(stats.errors) < ROUTER_MIN_SAMPLES:
+            return False
+        slo = config.get('latency_slo_ms')
+        p95 = stats.p95_latency_ms()
+        if slo is not None and (p95 is None or p95 > slo):
+            return False
+        if stats.error_rate() > ROUTER_MAX_ERROR_RATE:
+            return False
+        if model == primary:
+            return True
+        agreement = stats.agreement_rate()
+        return len(stats.agreements) >= ROUTER_MIN_SAMPLES and agreement >= ROUTER_MIN_AGREEMENT
+
+    def candidates(self, config):
+        primary = config['model']
+        return [primary] + [model for model in config.get('candidates', []) if model != primary]
+
+    def choose(self, config_type, config):
+        # Modèle le moins cher parmi ceux qui tiennent le SLO ; le modèle principal à défaut.
+        primary = config['model']
+        eligible = [model for model in self.candidates(config) if self._meets_slo(config_type, model, config, primary)]
+        if not eligible:
+            return primary
+        return min(eligible, key=lambda model: sum(MODEL_PRICES.get(model, (float('inf'), 0))))
+
+    def record(self, config_type, model, latency_ms, ok, usage):
+        stats = self.stats(config_type, model)
+        with self._lock:
+            stats.latencies.append(latency_ms)
+            stats.errors.append(not ok)
+            stats.cost += model_cost(model, usage or {})
+
+    def record_agreement(self, config_type, model, agreed):
+        stats = self.stats(config_type, model)
+        with self._lock:
+            stats.agreements.append(agreed)
+
+    def shadow_model(self, config_type, config, served_model):
+        # Modèle à rejouer en arrière-plan pour cet appel, ou None (la plupart du temps).
+        # La référence est toujours le modèle principal : s'il vient d'être servi, on évalue le candidat
+        # le moins mesuré ; sinon on rejoue le principal pour surveiller le candidat servi.
+        primary = config['model']
+        others = [model for model in self.candidates(config) if model != primary]
+        if not others or random.random() >= ROUTER_SHADOW_RATE:
+            return None
+        if served_model != primary:
+            return primary
+        return min(others, key=lambda model: len(self.stats(config_type, model).errors))
+
+
+model_router = ModelRouter()
+_shadow_executor = {"pid": None, "executor": None}
+
+
+def shadow_executor():
+    # Créé au premier appel fantôme de chaque worker, comme openai_session() : avec preload_app, un exécuteur
+    # créé à l'import le serait dans le master, avant que gevent ne patche threading dans le worker, et ses
+    # verrous natifs bloqueraient tout le worker au premier submit.
+    if _shadow_executor["pid"] != os.getpid():
+        _shadow_executor["executor"] = ThreadPoolExecutor(max_workers=2)
+        _shadow_executor["pid"] = os.getpid()
+    return _shadow_executor["executor"]
+
+
+def with_app_context(task):
+    # Les threads d'un ThreadPoolExecutor n'héritent pas du contexte Flask de l'appelant : la tâche
+    # est exécutée dans le contexte de la même application (base, configuration, journal d'usage).
+    if not has_app_context():
+        return task
+    app = current_app._get_current_object()
+
+    def run(*args, **kwargs):
+        with app.app_context():
+            return task(*args, **kwargs)
+    return run
+
+
+def timed_chat_completion(config_type, data, user_id=None, shadow=False):
+    # Envoie la requête, mesure la latence, alimente les statistiques du routeur et le journal d'usage.
+    started = time.monotonic()
+    try:
+        response = openai_session().post('https://api.openai.com/v1/chat/completions', json=data)
+    except Exception:
+        latency_ms = (time.monotonic() - started) * 1000
+        model_router.record(config_type, data['model'], latency_ms, False, None)
+        record_llm_usage(config_type, data['model'], user_id, 0, latency_ms, None, shadow)
+        raise
+    latency_ms = (time.monotonic() - started) * 1000
+    ok = response.status_code == 200
+    usage = response.json().get('usage') if ok else None
+    model_router.record(config_type, data['model'], latency_ms, ok, usage)
+    record_llm_usage(config_type, data['model'], user_id, response.status_code, latency_ms, usage, shadow)
+    return response
+
+
+def run_shadow(config_type, data, served_model, served_content, user_id=None):
+    # Rejoue la requête sur un autre modèle et note la concordance avec la réponse servie.
+    # La concordance est toujours attribuée au modèle qui n'est pas le principal.
+    primary = gpt_config(config_type)['model']
+    try:
+        response = timed_chat_completion(config_type, data, user_id, shadow=True)
+    except Exception as e:
+        logger.warning(f"Shadow call to {data['model']} failed: {e}")
+        return
+    if response.status_code != 200:
+        return
+    shadow_content = response.json()['choices'][0]['message']['content'].strip()
+    evaluated = data['model'] if served_model == primary else served_model
+    model_router.record_agreement(config_type, evaluated, answers_agree(shadow_content, served_content))
+
+
+def post_chat_completion(config_type, data):
+    # Point d'envoi unique des appels chat/completions de l'application.
+    # L'utilisateur est lu ici : l'appel fantôme tourne dans un thread, hors de la requête.
+    user_id = usage_user_id()
+    response = timed_chat_completion(config_type, data, user_id)
+    if response.status_code == 200:
+        shadow = model_router.shadow_model(config_type, gpt_config(config_type), data['model'])
+        if shadow is not None:
+            served_content = response.json()['choices'][0]['message']['content'].strip()
+            shadow_executor().submit(with_app_context(run_shadow), config_type, dict(data, model=shadow), data['model'], served_content, user_id)
+    return response
+
+
+
+# ! EXTENSION 17 jetons d'accès courts, jetons de rafraîchissement et révocation ---------------
+
+# Le jeton d'accès, vérifié à chaque requête, ne vit que quelques minutes ; le client en obtient un nouveau
+# via /refresh avec son jeton de rafraîchissement. La révocation (/logout) est consultée dans un filtre de
+# Bloom gardé en mémoire partagée : un jeton absent du filtre (le cas courant) est accepté sans requête SQL,
+# seule une réponse « peut-être révoqué » est confirmée dans la table revoked_token.
+ACCESS_TOKEN_EXPIRES = timedelta(minutes=int(os.environ.get('ACCESS_TOKEN_MINUTES', 15)))
+REFRESH_TOKEN_EXPIRES = timedelta(days=int(os.environ.get('REFRESH_TOKEN_DAYS', 30)))
+REVOCATION_FILTER_BITS = 1 << 23  # 1 Mo : ~1 % de faux positifs jusqu'à 800 000 jetons révoqués
+REVOCATION_FILTER_HASHES = 7
+REVOCATION_SYNC_SECONDS = 30
+REVOCATION_REBUILD_SECONDS = 6 * 3600
+# Les ids de revoked_token sont attribués à l'INSERT mais visibles au COMMIT : un id plus petit peut
+# apparaître après un plus grand. Chaque synchronisation relit donc aussi les derniers ids déjà chargés.
+REVOCATION_SYNC_ID_WINDOW = 1000
+
+
+class RevokedToken(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), unique=True, nullable=False)
+    token_type = db.Column(db.String(10), nullable=False)  # 'access' ou 'refresh'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # Au-delà, le jeton est refusé de toute façon
+
+
+class RevocationFilter:
+    # Filtre de Bloom dans une mmap anonyme créée avant le fork : une révocation ajoutée par un worker est
+    # vue immédiatement par les autres. L'en-tête garde la date de la dernière synchronisation avec la base,
+    # celle de la dernière reconstruction et le plus grand id de revoked_token déjà chargé, pour que les
+    # révocations faites sur une autre machine soient reprises en au plus REVOCATION_SYNC_SECONDS.
+    HEADER = struct.Struct('<ddQ')
+
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self._map = mmap.mmap(-1, self.HEADER.size + bits // 8)
+        self._lock = multiprocessing.Lock()
+
+    def _positions(self, jti):
+        # Double hachage : deux valeurs de 64 bits suffisent à dériver les k positions
+        digest = hashlib.blake2b(jti.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def might_contain(self, jti):
+        # Lecture sans verrou : les bits ne font que passer à 1 entre deux reconstructions
+        offset = self.HEADER.size
+        return all(self._map[offset + position // 8] & (1 << (position % 8)) for position in self._positions(jti))
+
+    def add(self, jti, bits=None):
+        target, offset = (self._map, self.HEADER.size) if bits is None else (bits, 0)
+        for position in self._positions(jti):
+            target[offset + position // 8] |= 1 << (position % 8)
+
+    def add_locked(self, jti):
+        with self._lock:
+            self.add(jti)
+
+    def header(self):
+        return self.HEADER.unpack_from(self._map, 0)
+
+    def claim_sync(self, interval):
+        # Un seul worker à la fois interroge la base ; les autres continuent avec le filtre actuel.
+        with self._lock:
+            synced_at, rebuilt_at, last_id = self.HEADER.unpack_from(self._map, 0)
+            now = time.time()
+            if now - synced_at < interval:
+                return None
+            self.HEADER.pack_into(self._map, 0, now, rebuilt_at, last_id)
+            return rebuilt_at, last_id
+
+    def extend(self, jtis, last_id):
+        with self._lock:
+            for jti in jtis:
+                self.add(jti)
+            synced_at, rebuilt_at, _ = self.HEADER.unpack_from(self._map, 0)
+            self.HEADER.pack_into(self._map, 0, synced_at, rebuilt_at, last_id)
+
+    def replace(self, jtis, last_id):
+        # Les jetons expirés ne sont pas retirables d'un filtre de Bloom : on reconstruit à part puis on
+        # recopie. Chaque octet recopié reste un sur-ensemble des bits encore utiles, aucun jeton révoqué
+        # et non expiré ne passe pendant la copie.
+        bits = bytearray(self.bits // 8)
+        for jti in jtis:
+            self.add(jti, bits)
+        with self._lock:
+            self._map[self.HEADER.size:] = bits
+            synced_at, _, _ = self.HEADER.unpack_from(self._map, 0)
+            self.HEADER.pack_into(self._map, 0, synced_at, time.time(), last_id)
+
+
+revocation_filter = RevocationFilter(REVOCATION_FILTER_BITS, REVOCATION_FILTER_HASHES)
+
+
+def sync_revocations(force_rebuild=False):
+    # Appelé à chaque vérification de jeton : ne coûte qu'une lecture de l'en-tête partagé
+    # tant que la dernière synchronisation date de moins de REVOCATION_SYNC_SECONDS.
+    claim = revocation_filter.claim_sync(0 if force_rebuild else REVOCATION_SYNC_SECONDS)
+    if claim is None:
+        return
+    rebuilt_at, last_id = claim
+    if force_rebuild or time.time() - rebuilt_at > REVOCATION_REBUILD_SECONDS:
+        now = datetime.utcnow()
+        RevokedToken.query.filter(RevokedToken.expires_at < now).delete(synchronize_session=False)
+        db.session.commit()
+        rows = db.session.query(RevokedToken.id, RevokedToken.jti).filter(RevokedToken.expires_at >= now).all()
+        revocation_filter.replace((jti for _, jti in rows), max((row_id for row_id, _ in rows), default=last_id))
+        logger.info("Revocation filter rebuilt with %s tokens", len(rows))
+    else:
+        # Relire des jetons déjà dans le filtre ne change rien : seuls ceux validés en retard y entrent
+        rows = db.session.query(RevokedToken.id, RevokedToken.jti).filter(
+            RevokedToken.id > last_id - REVOCATION_SYNC_ID_WINDOW
+        ).order_by(RevokedToken.id).all()
+        if rows:
+            revocation_filter.extend((jti for _, jti in rows), max(last_id, rows[-1][0]))
+
+
+@jwt.token_in_blocklist_loader
+def is_token_revoked(jwt_header, jwt_payload):
+    sync_revocations()
+    jti = jwt_payload['jti']
+    # Les jetons de rafraîchissement, rares, sont toujours vérifiés en base : une révocation faite sur
+    # une autre machine doit s'appliquer sans attendre la prochaine synchronisation du filtre.
+    if jwt_payload.get('type') != 'refresh' and not revocation_filter.might_contain(jti):
+        return False
+    return db.session.query(exists().where(RevokedToken.jti == jti)).scalar()
+
+
+def issue_tokens(user, refresh=True):
+    # L'id de l'utilisateur voyage dans le jeton : current_user_id() n'a plus besoin de le chercher.
+    claims = {"uid": user.id, "tz": user.timezone}
+    tokens = {"access_token": create_access_token(identity=user.email, additional_claims=claims)}
+    if refresh:
+        tokens["refresh_token"] = create_refresh_token(identity=user.email, additional_claims=claims)
+    return tokens
+
+
+def revoke_token(payload):
+    db.session.add(RevokedToken(
+        jti=payload['jti'],
+        token_type=payload.get('type', 'access'),
+        user_id=payload.get('uid'),
+        expires_at=datetime.utcfromtimestamp(payload['exp'])
+    ))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Déjà révoqué
+        db.session.rollback()
+    revocation_filter.add_locked(payload['jti'])
+
+
+@bp.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    # Rotation : le jeton de rafraîchissement utilisé est révoqué et remplacé.
+    user = db.session.get(User, current_user_id())
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    revoke_token(get_jwt())
+    return jsonify(**issue_tokens(user)), 200
+
+
+@bp.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    revoke_token(get_jwt())
+    refresh_token = (request.get_json(silent=True) or {}).get('refresh_token')
+    if refresh_token:
+        try:
+            payload = decode_token(refresh_token)
+        except Exception:
+            return jsonify({"error": "Invalid refresh token"}), 400
+        if payload.get('type') != 'refresh' or payload['sub'] != get_jwt_identity():
+            return jsonify({"error": "Invalid refresh token"}), 400
+        revoke_token(payload)
+    return jsonify({"message": "Logged out"}), 200
+
+
+
+# ! EXTENSION 18 page d'accueil statique ---------------
+
+# La page d'accueil ne dépend d'aucune donnée : elle est rendue une fois (buildassets.py au déploiement,
+# sinon à la première requête) dans static/dist sous un nom qui contient l'empreinte de son contenu,
+# avec ses variantes gzip et brotli. Un GET / n'est plus qu'un envoi de fichier.
+# L'URL / ne change jamais : elle est servie en no-cache, le navigateur revalide à chaque visite avec
+# If-None-Match et reçoit un 304 tant que la page n'a pas changé, et un déploiement se voit aussitôt.
+# Seules les URL empreintées (/assets/<fichier>) sont gardées longtemps en cache, sans revalidation.
+STATIC_DIST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'dist')
+STATIC_MANIFEST = 'manifest.json'
+ASSET_MAX_AGE = 365 * 24 * 3600
+LANDING_CONFIG_TYPE = 'support'
+LANDING_ANSWER_CACHE_SIZE = 500
+LANDING_ANSWER_TTL = timedelta(hours=1)
+
+
+def write_atomic(path, content):
+    # Plusieurs workers peuvent construire en même temps : aucun ne doit lire un fichier à moitié écrit
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as file:
+        file.write(content)
+    os.replace(temporary, path)
+
+
+def build_landing_assets(out_dir=STATIC_DIST_DIR):
+    html = render_template('index.html', question=None, response=None).encode('utf-8')
+    name = f"index.{hashlib.sha256(html).hexdigest()[:12]}.html"
+    os.makedirs(out_dir, exist_ok=True)
+    write_atomic(os.path.join(out_dir, name), html)
+    encodings = ['gzip']
+    write_atomic(os.path.join(out_dir, name + '.gz'), gzip.compress(html, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_atomic(os.path.join(out_dir, name + '.br'), brotli.compress(html, quality=11))
+        encodings.insert(0, 'br')
+    manifest = {"index.html": {"file": name, "encodings": encodings}}
+    write_atomic(os.path.join(out_dir, STATIC_MANIFEST), json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest
+
+
+_static_manifest = {"data": None}
+
+
+def static_manifest():
+    if _static_manifest["data"] is None:
+        try:
+            with open(os.path.join(STATIC_DIST_DIR, STATIC_MANIFEST), 'r') as file:
+                _static_manifest["data"] = json.load(file)
+        except FileNotFoundError:
+            _static_manifest["data"] = build_landing_assets()
+    return _static_manifest["data"]
+
+
+def send_static_asset(logical_name, fingerprinted_url=False):
+    # `fingerprinted_url` : la requête vise le nom empreinté, dont le contenu ne changera jamais
+    asset = static_manifest()[logical_name]
+    name, encoding = asset["file"], None
+    for candidate in asset["encodings"]:
+        if request.accept_encodings[candidate]:
+            encoding = candidate
+            break
+    suffix = {'br': '.br', 'gzip': '.gz', None: ''}[encoding]
+    response = send_file(
+        os.path.join(STATIC_DIST_DIR, name + suffix),
+        mimetype='text/html',
+        etag=f"{name}{suffix}",  # Une ETag par variante : les octets envoyés diffèrent
+        max_age=ASSET_MAX_AGE if fingerprinted_url else 0,
+        conditional=True
+    )
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    if fingerprinted_url:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+@bp.route('/assets/<name>', methods=['GET'])
+def fingerprinted_asset(name):
+    for logical_name, asset in static_manifest().items():
+        if asset["file"] == name:
+            return send_static_asset(logical_name, fingerprinted_url=True)
+    return jsonify({"error": "Asset not found"}), 404
+
+
+_landing_answers = OrderedDict()
+_landing_answers_lock = threading.Lock()
+
+
+def ask_landing_question(question):
+    # Même chemin que le reste de l'application (session HTTP partagée, routage des modèles), plus un petit
+    # cache des réponses : les pics de trafic sur la page d'accueil posent souvent les mêmes questions.
+    # rewrite_key écarte les questions longues ou contenant des données personnelles.
+    key = rewrite_key(question)
+    now = datetime.utcnow()
+    if key is not None:
+        with _landing_answers_lock:
+            cached = _landing_answers.get(key)
+            if cached is not None and cached[1] > now:
+                _landing_answers.move_to_end(key)
+                return cached[0]
+
+    data = chat_request(LANDING_CONFIG_TYPE, question)
+    response = post_chat_completion(LANDING_CONFIG_TYPE, data)
+    if response.status_code != 200:
+        logger.error('Failed to receive valid response from OpenAI: %s', response.text)
+        return "Error processing your request."
+    answer = response.json()['choices'][0]['message']['content'].strip()
+
+    if key is not None:
+        with _landing_answers_lock:
+            _landing_answers[key] = (answer, now + LANDING_ANSWER_TTL)
+            _landing_answers.move_to_end(key)
+            if len(_landing_answers) > LANDING_ANSWER_CACHE_SIZE:
+                _landing_answers.popitem(last=False)
+    return answer
+
+
+
+# ! EXTENSION 19 administration ---------------
+
+# /users pagine par clé (id > curseur) au lieu de OFFSET : chaque page coûte le même prix quel que soit
+# le nombre d'utilisateurs. Seules les colonnes affichées sont lues, jamais le hash du mot de passe.
+USERS_PAGE_SIZE = 100
+USERS_MAX_PAGE_SIZE = 1000
+
+
+def admin_required(view):
+    # À placer sous @jwt_required(). Le droit est relu en base à chaque appel plutôt que porté par le jeton,
+    # pour qu'un retrait prenne effet immédiatement ; ces routes sont rares.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = current_user_id()
+        if user_id is None or not db.session.query(User.is_admin).filter_by(id=user_id).scalar():
+            return jsonify({"error": "Admin access required"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def user_activity(user_ids):
+    # Nombre d'événements et dernière activité des seuls utilisateurs de la page,
+    # servis par l'index partiel (user_id, date) des événements non supprimés.
+    rows = db.session.query(PositiveEvent.user_id, func.count(), func.max(PositiveEvent.date)).filter(
+        PositiveEvent.user_id.in_(user_ids),
+        PositiveEvent.deleted_at.is_(None)
+    ).group_by(PositiveEvent.user_id)
+    return {user_id: (count, last_activity) for user_id, count, last_activity in rows}
+
+
+@bp.route('/users', methods=['GET'])
+@jwt_required()
+@admin_required
+def list_users():
+    try:
+        limit = min(int(request.args.get('limit', USERS_PAGE_SIZE)), USERS_MAX_PAGE_SIZE)
+        after = int(request.args.get('cursor', 0))
+    except ValueError:
+        return jsonify({"error": "limit and cursor must be integers"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    with_stats = 'stats' in request.args.get('include', '').split(',')
+
+    rows = db.session.query(User.id, User.email, User.display_name).filter(User.id > after).order_by(User.id).limit(limit).all()
+    activity = user_activity([row.id for row in rows]) if with_stats and rows else {}
+
+    users = []
+    for user_id, email, display_name in rows:
+        user = {"id": user_id, "email": email, "displayName": display_name}
+        if with_stats:
+            count, last_activity = activity.get(user_id, (0, None))
+            user["eventCount"] = count
+            user["lastActivity"] = last_activity.isoformat() if last_activity else None
+        users.append(user)
+
+    next_cursor = str(rows[-1].id) if len(rows) == limit else None
+    return json_response({"users": users, "nextCursor": next_cursor})
+
+
+@bp.cli.command('grant-admin')
+@click.argument('email')
+@click.option('--revoke', is_flag=True, help="Retire le droit d'administration au lieu de l'accorder.")
+def grant_admin_command(email, revoke):
+    # flask --app kokuahuane grant-admin email@exemple.fr
+    updated = User.query.filter_by(email=email).update({User.is_admin: not revoke})
+    db.session.commit()
+    if not updated:
+        click.echo(f"User not found: {email}")
+        sys.exit(1)
+    click.echo(f"{email}: admin {'revoked' if revoke else 'granted'}")
+
+
+
+# ! EXTENSION 20 suppression logique et purge ---------------
+
+# /delete_event ne fait que poser deleted_at. Pendant EVENT_UNDO_WINDOW l'utilisateur peut annuler ;
+# ensuite la commande purge-deleted efface les événements et leurs favoris par gros lots, à lancer
+# la nuit (Heroku Scheduler) : flask --app kokuahuane purge-deleted
+EVENT_UNDO_WINDOW = timedelta(minutes=10)
+PURGE_BATCH_SIZE = 5000
+PURGE_PAUSE_SECONDS = 0.2
+
+
+@bp.route('/restore_event/<int:event_id>', methods=['POST'])
+@jwt_required()
+@idempotent
+def restore_event(event_id):
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({"error": "User not found"}), 404
+
+    updated = PositiveEvent.query.filter(
+        PositiveEvent.id == event_id,
+        PositiveEvent.user_id == user_id,
+        PositiveEvent.deleted_at >= datetime.utcnow() - EVENT_UNDO_WINDOW
+    ).update({PositiveEvent.deleted_at: None}, synchronize_session=False)
+    if not updated:
+        return jsonify({"error": "Event not found or undo window expired"}), 404
+    record_change(user_id, 'restored', event_id)
+    db.session.commit()
+    return jsonify({"success": "Event restored"}), 200
+
+
+def purge_deleted_events(batch_size=PURGE_BATCH_SIZE, max_seconds=None, pause=PURGE_PAUSE_SECONDS):
+    # Chaque lot est sa propre transaction : les verrous sont relâchés entre deux lots. Les lignes à purger
+    # sont trouvées par l'index partiel sur deleted_at, qui ne contient que les événements supprimés.
+    cutoff = datetime.utcnow() - EVENT_UNDO_WINDOW
+    started = time.monotonic()
+    purged = 0
+    while max_seconds is None or time.monotonic() - started < max_seconds:
+        event_ids = [event_id for event_id, in db.session.query(PositiveEvent.id).filter(PositiveEvent.deleted_at < cutoff).limit(batch_size)]
+        if not event_ids:
+            break
+        Favorite.query.filter(Favorite.event_id.in_(event_ids)).delete(synchronize_session=False)
+        PositiveEvent.query.filter(PositiveEvent.id.in_(event_ids), PositiveEvent.deleted_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+        purged += len(event_ids)
+        logger.info("Purged %s deleted events", purged)
+        time.sleep(pause)
+    return purged
+
+
+@bp.cli.command('purge-deleted')
+@click.option('--batch-size', default=PURGE_BATCH_SIZE, help="Nombre d'événements effacés par transaction.")
+@click.option('--max-seconds', default=None, type=int, help="Durée maximale, pour rester dans la fenêtre creuse.")
+def purge_deleted_command(batch_size, max_seconds):
+    click.echo(f"Purged {purge_deleted_events(batch_size, max_seconds)} events")
+
+
+
+# ! EXTENSION 21 favoris par lots ---------------
+
+# Une sélection multiple dans l'interface devient un seul appel : un INSERT ... ON CONFLICT DO NOTHING
+# pour les ajouts et un DELETE ... = ANY(...) pour les retraits, quel que soit le nombre d'événements.
+FAVORITES_BATCH_MAX = 500
+FAVORITES_PAGE_SIZE = 50
+FAVORITES_MAX_PAGE_SIZE = 200
+
+
+def any_id(column, ids):
+    # `= ANY(:ids)` sur PostgreSQL : un seul paramètre tableau, donc une seule requête préparée
+    # quelle que soit la taille du lot. IN (...) classique ailleurs.
+    if uses_postgres():
+        from sqlalchemy.dialects.postgresql import ARRAY
+        return column == any_(literal(ids, ARRAY(db.Integer)))
+    return column.in_(ids)
+
+
+def insert_ignoring_conflicts(table):
+    if uses_postgres():
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def parse_event_ids(value):
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(isinstance(event_id, int) and not isinstance(event_id, bool) for event_id in value):
+        raise ValueError("event ids must be a list of integers")
+    return list(dict.fromkeys(value))
+
+
+def set_favorites(user_id, add_ids, remove_ids):
+    # Seuls les événements non supprimés de l'utilisateur peuvent être ajoutés. RETURNING donne les ids
+    # réellement modifiés, pour ne notifier que ceux-là.
+    added, removed = [], []
+    if add_ids:
+        own_events = db.select(literal(user_id), PositiveEvent.id).where(
+            PositiveEvent.user_id == user_id,
+            PositiveEvent.deleted_at.is_(None),
+            any_id(PositiveEvent.id, add_ids)
+        )
+        statement = insert_ignoring_conflicts(Favorite.__table__).from_select(['user_id', 'event_id'], own_events)
+        statement = statement.on_conflict_do_nothing(index_elements=['user_id', 'event_id']).returning(Favorite.__table__.c.event_id)
+        added = db.session.execute(statement).scalars().all()
+    if remove_ids:
+        statement = db.delete(Favorite.__table__).where(
+            Favorite.__table__.c.user_id == user_id,
+            any_id(Favorite.__table__.c.event_id, remove_ids)
+        ).returning(Favorite.__table__.c.event_id)
+        removed = db.session.execute(statement).scalars().all()
+
+    if added or removed:
+        bump_data_version(user_id)
+        for event_id in added:
+            publish_change(user_id, 'favorited', event_id)
+        for event_id in removed:
+            publish_change(user_id, 'unfavorited', event_id)
+    db.session.commit()
+    return added, removed
+
+
+@bp.route('/favorites/batch', methods=['POST'])
+@jwt_required()
+@idempotent
+def favorites_batch():
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({"error": "User not found"}), 404
+
+    data = request.get_json(silent=True) or {}
+    try:
+        add_ids = parse_event_ids(data.get('add'))
+        remove_ids = parse_event_ids(data.get('remove'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if set(add_ids) & set(remove_ids):
+        return jsonify({"error": "An event cannot be both added and removed"}), 400
+    if len(add_ids) + len(remove_ids) > FAVORITES_BATCH_MAX:
+        return jsonify({"error": f"At most {FAVORITES_BATCH_MAX} events per batch"}), 400
+
+    added, removed = set_favorites(user_id, add_ids, remove_ids)
+    return jsonify({"added": sorted(added), "removed": sorted(removed)}), 200
+
+
+@bp.route('/favorites', methods=['GET'])
+@jwt_required()
+def list_favorites():
+    user = db.session.get(User, current_user_id())
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    try:
+        limit = min(int(request.args.get('limit', FAVORITES_PAGE_SIZE)), FAVORITES_MAX_PAGE_SIZE)
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({"error": "limit and cursor must be integers"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    etag = data_version_etag(user, 'favorites', limit, cursor or '')
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    # Du plus récemment ajouté au plus ancien, paginé par l'id du favori
+    query = db.session.query(Favorite.id, PositiveEvent.id, PositiveEvent.description, PositiveEvent.date).join(
+        PositiveEvent, PositiveEvent.id == Favorite.event_id
+    ).filter(
+        Favorite.user_id == user.id,
+        PositiveEvent.deleted_at.is_(None)
+    )
+    if cursor is not None:
+        query = query.filter(Favorite.id < cursor)
+    rows = query.order_by(Favorite.id.desc()).limit(limit).all()
+
+    favorites = [
+        {"id": event_id, "description": description, "date": date.isoformat()}
+        for favorite_id, event_id, description, date in rows
+    ]
+    next_cursor = str(rows[-1][0]) if len(rows) == limit else None
+    response = json_response({"favorites": favorites, "nextCursor": next_cursor})
+    response.set_etag(etag, weak=True)
+    return response
+
+
+
+# ! EXTENSION 22 catégorisation des événements ---------------
+
+# Un classifieur par mots-clés, local et instantané, fixe la catégorie à l'enregistrement. Quand il n'est
+# pas assez sûr, la catégorie reste NULL : l'événement est « à classer » et la commande classify-events
+# (Heroku Scheduler, toutes les dix minutes) les envoie par lots à l'API. categorize-backfill reprend
+# les anciens événements, tous restés sur la valeur par défaut 'souvenir'.
+DEFAULT_CATEGORY = 'souvenir'
+CATEGORY_MIN_CONFIDENCE = 0.75
+CATEGORIZE_LLM_BATCH_SIZE = 20
+CATEGORIZE_QUEUE_LIMIT = 2000
+CATEGORIZE_CHUNK_SIZE = 500
+CATEGORIZE_CONCURRENCY = 4
+CATEGORY_BACKFILL_JOB = 'category-backfill'
+
+# Mots sans accents ni majuscules. Un mot-clé d'au moins 5 lettres vaut aussi comme préfixe ("randonn").
+CATEGORY_KEYWORDS = {
+    'sport': ['sport', 'couru', 'courir', 'course', 'footing', 'jogging', 'velo', 'natation', 'nage', 'muscu', 'musculation',
+              'gym', 'yoga', 'pilates', 'randonn', 'rando', 'foot', 'football', 'tennis', 'piscine', 'entrainement', 'etirement',
+              'danse', 'escalade', 'marathon', 'salle'],
+    'social': ['ami', 'amis', 'amie', 'amies', 'copain', 'copains', 'copine', 'copines', 'voisin', 'voisine', 'soiree', 'fete',
+               'diner', 'dejeuner', 'apero', 'rencontr', 'discute', 'discussion', 'appele', 'telephone', 'invite', 'retrouve'],
+    'famille': ['famille', 'maman', 'mere', 'papa', 'pere', 'enfant', 'enfants', 'fils', 'fille', 'filles', 'frere', 'soeur',
+                'mamie', 'papi', 'grand', 'bebe', 'cousin', 'cousine', 'parents', 'mari', 'femme', 'conjoint'],
+    'travail': ['travail', 'travaille', 'boulot', 'bureau', 'reunion', 'projet', 'client', 'clients', 'mission', 'presentation',
+                'dossier', 'collegue', 'collegues', 'entretien', 'promotion', 'manager', 'equipe'],
+    'apprentissage': ['appris', 'apprendre', 'lu', 'lire', 'livre', 'lecture', 'etudie', 'etudier', 'formation', 'revise',
+                      'examen', 'langue', 'lecon', 'tutoriel', 'podcast', 'documentaire', 'decouvert'],
+    'bien-etre': ['medite', 'meditation', 'dormi', 'sieste', 'repos', 'reposer', 'detendu', 'detente', 'relaxation', 'bain',
+                  'massage', 'respiration', 'respire', 'calme', 'serein', 'sereine'],
+    'nature': ['nature', 'foret', 'jardin', 'jardine', 'plante', 'plantes', 'fleur', 'fleurs', 'mer', 'plage', 'montagne',
+               'soleil', 'parc', 'oiseau', 'oiseaux', 'balade', 'promenade', 'promene', 'lac', 'riviere', 'coucher'],
+    'creativite': ['dessin', 'dessine', 'peint', 'peinture', 'musique', 'guitare', 'piano', 'chante', 'chanson', 'ecrit',
+                   'ecrire', 'photo', 'photos', 'cuisine', 'cuisiner', 'bricol', 'tricot', 'poeme', 'atelier', 'patisserie'],
+    'entraide': ['aide', 'aider', 'service', 'benevol', 'don', 'offert', 'soutenu', 'soutien', 'ecoute', 'conseille',
+                 'remercie', 'merci'],
+}
+CATEGORIES = list(CATEGORY_KEYWORDS) + [DEFAULT_CATEGORY]
+
+
+class JobCheckpoint(db.Model):
+    # Position atteinte par un traitement long, enregistrée dans la même transaction que ses écritures
+    name = db.Column(db.String(64), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+def keyword_scores(description):
+    scores = Counter()
+    for word in re.findall(r"[a-z]+", normalize_for_search(description)):
+        for category, keywords in CATEGORY_KEYWORDS.items():
+            if any(word == keyword or (len(keyword) >= 5 and word.startswith(keyword)) for keyword in keywords):
+                scores[category] += 1
+    return scores
+
+
+def classify_event_locally(description):
+    # Renvoie la catégorie, ou None si aucune ne se détache assez nettement des autres.
+    ranked = keyword_scores(description).most_common(2)
+    if not ranked:
+        return None
+    top = ranked[0][1]
+    second = ranked[1][1] if len(ranked) > 1 else 0
+    return ranked[0][0] if top / (top + second) >= CATEGORY_MIN_CONFIDENCE else None
+
+
+def classify_with_llm(descriptions):
+    # Un seul appel pour tout le lot. Renvoie une catégorie par description, ou None si l'appel échoue.
+    lines = "\n".join(f"{index}. {' '.join(description.split())}" for index, description in enumerate(descriptions, 1))
+    prompt = f"Catégories : {', '.join(CATEGORIES)}\n{lines}"
+    response = post_chat_completion('categorize', chat_request('categorize', prompt))
+    if response.status_code != 200:
+        logger.error('Categorization failed: %s', response.text)
+        return None
+    content = response.json()['choices'][0]['message']['content'].strip()
+    try:
+        answers = json.loads(content[content.find('{'):content.rfind('}') + 1])
+    except ValueError:
+        logger.error('Unreadable categorization answer: %s', content)
+        return None
+    categories = []
+    for index in range(1, len(descriptions) + 1):
+        category = str(answers.get(str(index), '')).strip().lower()
+        categories.append(category if category in CATEGORIES else DEFAULT_CATEGORY)
+    return categories
+
+
+def classify_batches(executor, rows):
+    # rows : [(id, description)] -> {id: catégorie}, appels à l'API en parallèle, bornés par l'executor.
+    batches = [rows[i:i + CATEGORIZE_LLM_BATCH_SIZE] for i in range(0, len(rows), CATEGORIZE_LLM_BATCH_SIZE)]
+    results = {}
+    for batch, categories in zip(batches, executor.map(with_app_context(lambda batch: classify_with_llm([row[1] for row in batch])), batches)):
+        if categories is not None:
+            results.update((event_id, category) for (event_id, _), category in zip(batch, categories))
+    return results
+
+
+def apply_categories(assignments):
+    # Une mise à jour par catégorie plutôt qu'une par ligne
+    by_category = {}
+    for event_id, category in assignments.items():
+        by_category.setdefault(category, []).append(event_id)
+    for category, event_ids in by_category.items():
+        PositiveEvent.query.filter(PositiveEvent.id.in_(event_ids)).update({PositiveEvent.category: category}, synchronize_session=False)
+
+
+def classify_pending_events(limit=CATEGORIZE_QUEUE_LIMIT, concurrency=CATEGORIZE_CONCURRENCY):
+    # File d'attente = événements non supprimés sans catégorie, trouvés par un index partiel.
+    rows = db.session.query(PositiveEvent.id, PositiveEvent.description).filter(
+        PositiveEvent.category.is_(None),
+        PositiveEvent.deleted_at.is_(None)
+    ).order_by(PositiveEvent.id).limit(limit).all()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = classify_batches(executor, [tuple(row) for row in rows])
+    apply_categories(results)
+    db.session.commit()
+    return len(results), len(rows) - len(results)
+
+
+def backfill_categories(chunk_size=CATEGORIZE_CHUNK_SIZE, concurrency=CATEGORIZE_CONCURRENCY, restart=False):
+    # Parcourt les événements restés sur la valeur par défaut, par tranches d'ids croissants. La position
+    # est enregistrée avec les catégories de chaque tranche : une interruption ne perd au plus qu'une tranche.
+    checkpoint = db.session.get(JobCheckpoint, CATEGORY_BACKFILL_JOB) or JobCheckpoint(name=CATEGORY_BACKFILL_JOB, position=0)
+    if restart:
+        checkpoint.position, checkpoint.finished_at = 0, None
+    if checkpoint.finished_at is not None:
+        return 0
+    processed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            rows = db.session.query(PositiveEvent.id, PositiveEvent.description).filter(
+                PositiveEvent.id > checkpoint.position,
+                PositiveEvent.category == DEFAULT_CATEGORY,
+                PositiveEvent.deleted_at.is_(None)
+            ).order_by(PositiveEvent.id).limit(chunk_size).all()
+            if not rows:
+                checkpoint.finished_at = datetime.utcnow()
+                db.session.add(checkpoint)
+                db.session.commit()
+                return processed
+
+            assignments, uncertain = {}, []
+            for event_id, description in rows:
+                category = classify_event_locally(description)
+                if category is None:
+                    uncertain.append((event_id, description))
+                else:
+                    assignments[event_id] = category
+            llm_results = classify_batches(executor, uncertain)
+            # Un lot refusé par l'API part dans la file d'attente de classify-events
+            assignments.update((event_id, llm_results.get(event_id)) for event_id, _ in uncertain)
+            apply_categories(assignments)
+
+            checkpoint.position = rows[-1][0]
+            db.session.add(checkpoint)
+            db.session.commit()
+            processed += len(rows)
+            logger.info("Category backfill: %s events, position %s", processed, checkpoint.position)
+
+
+@bp.cli.command('classify-events')
+@click.option('--limit', default=CATEGORIZE_QUEUE_LIMIT, help="Nombre maximal d'événements à classer.")
+@click.option('--concurrency', default=CATEGORIZE_CONCURRENCY, help="Nombre maximal d'appels simultanés à l'API.")
+def classify_events_command(limit, concurrency):
+    # flask --app kokuahuane classify-events
+    classified, failed = classify_pending_events(limit, concurrency)
+    click.echo(f"{classified} events classified, {failed} left in the queue")
+
+
+@bp.cli.command('categorize-backfill')
+@click.option('--chunk-size', default=CATEGORIZE_CHUNK_SIZE, help="Nombre d'événements par tranche.")
+@click.option('--concurrency', default=CATEGORIZE_CONCURRENCY, help="Nombre maximal d'appels simultanés à l'API.")
+@click.option('--restart', is_flag=True, help="Repart du début au lieu de reprendre au dernier point de contrôle.")
+def categorize_backfill_command(chunk_size, concurrency, restart):
+    # flask --app kokuahuane categorize-backfill ; relancer la même commande reprend là où elle s'est arrêtée
+    click.echo(f"{backfill_categories(chunk_size, concurrency, restart)} events processed")
+
+
+
+# ! EXTENSION 23 cache des réponses de /get_actions ---------------
+
+# Deux niveaux : un LRU propre au worker, puis, si ACTIONS_CACHE_DIR est défini (idéalement sur /dev/shm),
+# des fichiers partagés par les workers de la machine. Chaque entrée porte la génération de l'utilisateur
+# au moment du calcul ; les générations vivent dans une table en mémoire partagée, incrémentée au COMMIT
+# de toute écriture qui passe par bump_data_version. Sur PostgreSQL, les écritures faites par une autre
+# machine arrivent par LISTEN/NOTIFY : tant que l'écoute n'est pas établie, rien n'est mis en cache.
+ACTIONS_CACHE_SIZE = 10000
+ACTIONS_CACHE_SLOTS = 1 << 16
+ACTIONS_CACHE_DIR = os.environ.get('ACTIONS_CACHE_DIR')
+
+
+class ActionsCache:
+
+    def __init__(self, size, slots, directory=None):
+        self.size = size
+        self.directory = directory
+        # Époque de départ tirée au hasard à chaque démarrage : les fichiers survivent à un redémarrage de
+        # gunicorn, pas la table des générations, qui repart de zéro ; sans cela une ancienne entrée dont
+        # (époque, génération) coïncide avec les nouveaux compteurs serait servie comme à jour.
+        self._generations = SharedLookupTable(slots, epoch=random.SystemRandom().getrandbits(48))
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, user_id):
+        return hashlib.blake2b(str(user_id).encode(), digest_size=16, person=b'get_actions').digest()
+
+    def version(self, user_id):
+        # (époque, génération) : clear() change l'époque, ce qui périme toutes les entrées d'un coup
+        return self._generations.table_version(), self._generations.get(self._digest(user_id)) or 0
+
+    def invalidate(self, user_id):
+        if not self._generations.increment(self._digest(user_id)):
+            self.reset()
+
+    def reset(self):
+        self._generations.clear()
+
+    def can_store(self):
+        if not uses_postgres():
+            return True
+        change_broker.start_listener(db.engine)
+        return change_broker.listening.is_set()
+
+    def _remember(self, user_id, entry):
+        with self._lock:
+            self._memory[user_id] = entry
+            self._memory.move_to_end(user_id)
+            if len(self._memory) > self.size:
+                self._memory.popitem(last=False)
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, f"{user_id}.json")
+
+    def get(self, user_id, day):
+        version = self.version(user_id)
+        with self._lock:
+            entry = self._memory.get(user_id)
+            if entry is not None and entry[0] == version and entry[1] == day:
+                self._memory.move_to_end(user_id)
+                return entry[2], entry[3]
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(user_id), 'rb') as file:
+                header, body = file.read().split(b'\n', 1)
+        except (FileNotFoundError, ValueError):
+            return None
+        epoch, generation, stored_day, etag = header.decode().split(' ')
+        if (int(epoch), int(generation)) != version or stored_day != day.isoformat():
+            return None
+        self._remember(user_id, (version, day, etag, body))
+        return etag, body
+
+    def put(self, user_id, version, day, etag, body):
+        self._remember(user_id, (version, day, etag, body))
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            header = f"{version[0]} {version[1]} {day.isoformat()} {etag}\n".encode()
+            write_atomic(self._path(user_id), header + body)
+
+
+actions_cache = ActionsCache(ACTIONS_CACHE_SIZE, ACTIONS_CACHE_SLOTS, ACTIONS_CACHE_DIR)
+change_broker.add_hooks(lambda change: actions_cache.invalidate(change['user_id']), actions_cache.reset)
+
+
+@sa_event.listens_for(db.session, 'after_commit')
+def invalidate_cached_actions(session):
+    for user_id in session.info.pop('changed_users', ()):
+        actions_cache.invalidate(user_id)
+
+
+@sa_event.listens_for(db.session, 'after_rollback')
+def discard_changed_users(session):
+    session.info.pop('changed_users', None)
+
+
+
+# ! EXTENSION 24 fuseaux horaires et bornes de journées ---------------
+
+# Les journées de l'utilisateur commencent à minuit dans son fuseau (User.timezone), pas à minuit UTC.
+# Les bornes sont calculées une fois par requête, en UTC naïf comme les dates stockées, puis passées
+# telles quelles au WHERE / CASE : aucune conversion ligne par ligne. Toute API qui filtre par jour
+# ou par plage de jours doit passer par day_bounds().
+DEFAULT_TIMEZONE = 'Europe/Paris'
+
+
+def is_valid_timezone(name):
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def user_zone(name):
+    # ZoneInfo garde ses instances en cache : l'appel ne relit pas la base tz à chaque requête
+    return ZoneInfo(name) if name and is_valid_timezone(name) else ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def current_user_timezone(user_id):
+    # Fuseau porté par le jeton (revendication tz) ; lu en base pour les jetons plus anciens.
+    name = get_jwt().get('tz')
+    if name is None and user_id is not None:
+        name = db.session.query(User.timezone).filter_by(id=user_id).scalar()
+    return name
+
+
+def local_today(zone):
+    return datetime.now(zone).date()
+
+
+def day_bounds(zone, first_day, days):
+    # Débuts des journées locales first_day .. first_day + days, en UTC naïf : days + 1 bornes.
+    # Chaque minuit est converti séparément, ce qui tient compte des changements d'heure.
+    return [
+        datetime(day.year, day.month, day.day, tzinfo=zone).astimezone(timezone.utc).replace(tzinfo=None)
+        for day in (first_day + timedelta(days=offset) for offset in range(days + 1))
+    ]
+
+
+@bp.route('/settings/timezone', methods=['POST'])
+@jwt_required()
+def update_timezone():
+    user = db.session.get(User, current_user_id())
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    name = (request.get_json(silent=True) or {}).get('timezone')
+    if not name or not is_valid_timezone(name):
+        return jsonify({"error": "Unknown timezone"}), 400
+
+    user.timezone = name
+    # Les groupes de /get_actions changent : même invalidation et même notification (autres workers
+    # via NOTIFY, flux SSE) qu'une modification d'événement
+    record_change(user.id, 'settings', None)
+    db.session.commit()
+    # Nouveau jeton d'accès, qui porte le nouveau fuseau
+    return jsonify(timezone=name, **issue_tokens(user, refresh=False)), 200
+
+
+
+# ! EXTENSION 25 journal d'usage des appels au modèle ---------------
+
+# Chaque appel chat/completions laisse une ligne dans llm_usage (jetons, modèle, latence, configuration,
+# utilisateur). Les lignes ne sont jamais modifiées ; rollup-llm-usage en tire les agrégats quotidiens
+# de llm_usage_daily, que sert /usage et que lisent limites de débit, routage et prévisions de capacité.
+LLM_USAGE_BATCH_SIZE = 500
+LLM_USAGE_FLUSH_SECONDS = 5
+LLM_USAGE_QUEUE_SIZE = 20000
+LLM_USAGE_ROLLUP_DAYS = 2
+LLM_USAGE_RETENTION_DAYS = int(os.getenv('LLM_USAGE_RETENTION_DAYS', 90))
+USAGE_DEFAULT_DAYS = 30
+USAGE_DIMENSIONS = {'day', 'user', 'config_type', 'model', 'shadow'}
+
+
+class LlmUsage(db.Model):
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    user_id = db.Column(db.Integer, nullable=True)  # Sans clé étrangère : le journal survit aux comptes supprimés
+    config_type = db.Column(db.String(50), nullable=False)
+    model = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.Integer, nullable=False)  # Code HTTP de l'API, 0 si l'appel n'a pas abouti
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    latency_ms = db.Column(db.Integer, nullable=False)
+    cost = db.Column(db.Float, nullable=False, default=0.0)  # En dollars, au prix de MODEL_PRICES le jour de l'appel
+    shadow = db.Column(db.Boolean, nullable=False, default=False)  # Appel d'évaluation fantôme du routeur
+
+    __table_args__ = (db.Index('ix_llm_usage_user_created_at', 'user_id', 'created_at'),)
+
+
+class LlmUsageDaily(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)  # Jour UTC
+    user_id = db.Column(db.Integer, nullable=True)
+    config_type = db.Column(db.String(50), nullable=False)
+    model = db.Column(db.String(50), nullable=False)
+    shadow = db.Column(db.Boolean, nullable=False)
+    calls = db.Column(db.Integer, nullable=False)
+    errors = db.Column(db.Integer, nullable=False)
+    prompt_tokens = db.Column(db.BigInteger, nullable=False)
+    completion_tokens = db.Column(db.BigInteger, nullable=False)
+    latency_ms = db.Column(db.BigInteger, nullable=False)  # Somme : latence moyenne = latency_ms / calls
+    cost = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.Index('ix_llm_usage_daily_user_day', 'user_id', 'day'),)
+
+
+class UsageLedger:
+    # Les appels déposent leur ligne dans une file en mémoire ; un thread par worker la vide toutes les
+    # LLM_USAGE_FLUSH_SECONDS (ou dès LLM_USAGE_BATCH_SIZE lignes) en un INSERT multi-lignes par lot,
+    # hors du chemin de la requête. Si la base ne suit plus, les lignes en trop sont perdues et comptées
+    # plutôt que de ralentir les appels.
+    # File, signal et thread sont créés dans chaque worker, après le fork, comme shadow_executor() :
+    # créés à l'import dans le master, ils garderaient des verrous natifs que gevent n'a pas patchés.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._wake = None
+        self._writer_started = False
+        self._app = None
+        self.dropped = 0
+
+    def init_app(self, app):
+        # Appelé par create_app() : les appels des threads d'exécuteurs et des tâches de fond, sans
+        # contexte Flask, sont écrits comme ceux des requêtes.
+        self._app = app
+
+    def _process_queue(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=LLM_USAGE_QUEUE_SIZE)
+                    self._wake = threading.Event()
+                    self._writer_started = False
+                    self._pid = os.getpid()
+        return self._queue
+
+    def record(self, row):
+        rows = self._process_queue()
+        try:
+            rows.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning("Usage ledger queue full, %s rows dropped so far", self.dropped)
+        if rows.qsize() >= LLM_USAGE_BATCH_SIZE:
+            self._wake.set()
+        self._ensure_writer()
+
+    def _ensure_writer(self):
+        if self._writer_started or self._app is None:
+            return
+        with self._lock:
+            if self._writer_started:
+                return
+            self._writer_started = True
+            threading.Thread(target=self._run, name='usage-ledger', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(LLM_USAGE_FLUSH_SECONDS)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        # Écrit tout ce qui attend dans la file ; aussi appelé à la sortie du processus et avant un rollup.
+        if self._app is None or self._pid != os.getpid():
+            return 0
+        written = 0
+        while True:
+            batch = []
+            while len(batch) < LLM_USAGE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return written
+            try:
+                with self._app.app_context():
+                    with db.engine.begin() as connection:
+                        connection.execute(LlmUsage.__table__.insert(), batch)
+                written += len(batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} usage rows: {e}")
+                return written
+
+
+usage_ledger = UsageLedger()
+atexit.register(usage_ledger.flush)
+
+
+def usage_user_id():
+    # Utilisateur à qui imputer l'appel : celui du jeton vérifié par la requête en cours ; None pour
+    # les routes publiques, les commandes CLI et les tâches de fond.
+    if not has_request_context():
+        return None
+    try:
+        claims = get_jwt()
+    except RuntimeError:
+        return None
+    return current_user_id() if claims else None
+
+
+def record_llm_usage(config_type, model, user_id, status, latency_ms, usage, shadow=False):
+    usage = usage or {}
+    usage_ledger.record({
+        "created_at": datetime.utcnow(),
+        "user_id": user_id,
+        "config_type": config_type,
+        "model": model,
+        "status": status,
+        "prompt_tokens": usage.get('prompt_tokens', 0),
+        "completion_tokens": usage.get('completion_tokens', 0),
+        "latency_ms": round(latency_ms),
+        "cost": model_cost(model, usage),
+        "shadow": shadow,
+    })
+
+
+def rollup_llm_usage(days=LLM_USAGE_ROLLUP_DAYS):
+    # Recalcule entièrement les agrégats des `days` derniers jours UTC à partir du journal : relancer la
+    # commande ne compte rien deux fois, et les lots écrits en retard autour de minuit sont repris.
+    usage_ledger.flush()
+    first_day = datetime.utcnow().date() - timedelta(days=days - 1)
+    day = func.date(LlmUsage.created_at)
+    rows = db.select(
+        day, LlmUsage.user_id, LlmUsage.config_type, LlmUsage.model, LlmUsage.shadow,
+        func.count(), func.sum(case((LlmUsage.status == 200, 0), else_=1)),
+        func.sum(LlmUsage.prompt_tokens), func.sum(LlmUsage.completion_tokens),
+        func.sum(LlmUsage.latency_ms), func.sum(LlmUsage.cost)
+    ).where(
+        LlmUsage.created_at >= datetime.combine(first_day, datetime.min.time())
+    ).group_by(day, LlmUsage.user_id, LlmUsage.config_type, LlmUsage.model, LlmUsage.shadow)
+
+    LlmUsageDaily.query.filter(LlmUsageDaily.day >= first_day).delete(synchronize_session=False)
+    inserted = db.session.execute(LlmUsageDaily.__table__.insert().from_select([
+        'day', 'user_id', 'config_type', 'model', 'shadow', 'calls', 'errors',
+        'prompt_tokens', 'completion_tokens', 'latency_ms', 'cost'
+    ], rows)).rowcount
+    db.session.commit()
+    return inserted
+
+
+def purge_llm_usage(retention_days=LLM_USAGE_RETENTION_DAYS):
+    # Les lignes brutes ne servent plus une fois agrégées ; la rétention reste bien plus longue
+    # que la fenêtre du rollup pour pouvoir recalculer un agrégat en cas de besoin.
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    purged = LlmUsage.query.filter(LlmUsage.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return purged
+
+
+@bp.cli.command('rollup-llm-usage')
+@click.option('--days', default=LLM_USAGE_ROLLUP_DAYS, help="Nombre de jours (UTC) à recalculer, aujourd'hui compris.")
+@click.option('--purge', is_flag=True, help="Efface aussi les lignes brutes plus anciennes que LLM_USAGE_RETENTION_DAYS.")
+def rollup_llm_usage_command(days, purge):
+    # flask --app kokuahuane rollup-llm-usage, à planifier toutes les heures
+    click.echo(f"Rolled up {rollup_llm_usage(days)} daily usage rows")
+    if purge:
+        click.echo(f"Purged {purge_llm_usage()} usage rows")
+
+
+def parse_usage_day(value, default):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else default
+
+
+@bp.route('/usage', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_usage():
+    # /usage?from=2026-10-01&to=2026-10-19&group_by=user,config_type&user_id=42
+    # Lit les agrégats quotidiens : la journée en cours n'apparaît qu'après le dernier rollup-llm-usage.
+    try:
+        last_day = parse_usage_day(request.args.get('to'), datetime.utcnow().date())
+        first_day = parse_usage_day(request.args.get('from'), last_day - timedelta(days=USAGE_DEFAULT_DAYS - 1))
+        user_id = request.args.get('user_id', type=int)
+    except ValueError:
+        return jsonify({"error": "from and to must be dates (YYYY-MM-DD)"}), 400
+    group_by = [dimension for dimension in request.args.get('group_by', 'day').split(',') if dimension]
+    unknown = set(group_by) - USAGE_DIMENSIONS
+    if unknown:
+        return jsonify({"error": f"Unknown group_by: {', '.join(sorted(unknown))}"}), 400
+
+    columns = {
+        'day': LlmUsageDaily.day,
+        'user': LlmUsageDaily.user_id,
+        'config_type': LlmUsageDaily.config_type,
+        'model': LlmUsageDaily.model,
+        'shadow': LlmUsageDaily.shadow,
+    }
+    keys = [columns[dimension] for dimension in group_by]
+    query = db.session.query(
+        *keys,
+        func.sum(LlmUsageDaily.calls), func.sum(LlmUsageDaily.errors),
+        func.sum(LlmUsageDaily.prompt_tokens), func.sum(LlmUsageDaily.completion_tokens),
+        func.sum(LlmUsageDaily.latency_ms), func.sum(LlmUsageDaily.cost)
+    ).filter(LlmUsageDaily.day >= first_day, LlmUsageDaily.day <= last_day)
+    if user_id is not None:
+        query = query.filter(LlmUsageDaily.user_id == user_id)
+    if request.args.get('config_type'):
+        query = query.filter(LlmUsageDaily.config_type == request.args['config_type'])
+    if keys:
+        query = query.group_by(*keys).order_by(*keys)
+
+    rows = []
+    for row in query:
+        values = dict(zip(group_by, row[:len(keys)]))
+        if 'day' in values:
+            values['day'] = values['day'].isoformat()
+        if 'user' in values:
+            values['userId'] = values.pop('user')
+        if 'config_type' in values:
+            values['configType'] = values.pop('config_type')
+        calls, errors, prompt_tokens, completion_tokens, latency_ms, cost = row[len(keys):]
+        if not calls:
+            continue
+        rows.append(dict(values,
+                         calls=calls,
+                         errors=errors,
+                         promptTokens=prompt_tokens,
+                         completionTokens=completion_tokens,
+                         meanLatencyMs=round(latency_ms / calls),
+                         cost=round(cost, 6)))
+    return json_response({"from": first_day.isoformat(), "to": last_day.isoformat(), "groupBy": group_by, "rows": rows})
+
+
+
+
+app = create_app()
+
 
 # Point d'entrée pour décider d'exécuter l'application ou le test
 if __name__ == "__main__":
@@ -1,4 +1,6 @@
 import logging
+import os
+import sys
 from logging.config import fileConfig
 
 from flask import current_app
@@ -14,6 +16,9 @@ config = context.config
 fileConfig(config.config_file_name)
 logger = logging.getLogger('alembic.env')
 
+# rend migrations/online_ops.py importable depuis les scripts de migration
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
 
 def get_engine():
     try:
@@ -97,6 +102,9 @@ def run_migrations_online():
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        # une transaction par migration : les verrous d'une révision ne sont
+        # pas gardés pendant l'exécution des suivantes
+        conf_args.setdefault("transaction_per_migration", True)
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
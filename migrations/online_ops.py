@@ -0,0 +1,157 @@
+"""Opérations de migration sans interruption de service.
+
+Les scripts générés par autogenerate ajoutent une colonne NOT NULL en une
+seule étape (voir bca38951ae47), ce qui réécrit et verrouille toute la table.
+Ces helpers découpent ce genre de changement en étapes qui ne bloquent ni
+les lectures ni les écritures de l'application :
+
+    from online_ops import add_column, backfill, set_not_null, create_index
+
+    def upgrade():
+        add_column('user', sa.Column('timezone', sa.String(64)))
+        backfill('user', "timezone = 'Europe/Paris'", "timezone IS NULL")
+        set_not_null('user', 'timezone')
+        create_index('ix_user_timezone', 'user', ['timezone'])
+
+Sur une autre base que PostgreSQL (SQLite en local), ils se replient sur les
+opérations Alembic classiques.
+"""
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.online')
+
+LOCK_TIMEOUT = '5s'
+BACKFILL_BATCH_SIZE = 10000
+BACKFILL_PAUSE_SECONDS = 0.1
+
+
+def is_postgres():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+@contextmanager
+def lock_timeout(timeout=LOCK_TIMEOUT):
+    # Abandonne plutôt que de faire la queue derrière une longue transaction,
+    # ce qui bloquerait à son tour toutes les requêtes de l'application.
+    # Ne s'applique qu'aux instructions du bloc : la valeur précédente est rétablie en sortie
+    # (SET LOCAL resterait actif jusqu'à la fin de la transaction, et n'a aucun effet hors transaction).
+    # En cas d'erreur, la transaction échoue et son SET est annulé avec elle.
+    if not is_postgres():
+        yield
+        return
+    previous = op.get_bind().execute(sa.text("SHOW lock_timeout")).scalar()
+    op.execute(f"SET lock_timeout = '{timeout}'")
+    yield
+    op.execute(f"SET lock_timeout = '{previous}'")
+
+
+def add_column(table, column):
+    # Ajoute la colonne sans contrainte NOT NULL : simple changement de catalogue, sans réécriture.
+    column.nullable = True
+    with lock_timeout():
+        op.add_column(table, column)
+
+
+def backfill(table, assignment, where, batch_size=BACKFILL_BATCH_SIZE, pause=BACKFILL_PAUSE_SECONDS, key='id'):
+    # Remplit la colonne par lots, chacun dans sa propre transaction, en dormant entre deux lots
+    # pour laisser respirer la base. `where` doit exclure les lignes déjà traitées.
+    total = op.get_bind().execute(sa.text(f'SELECT count(*) FROM "{table}" WHERE {where}')).scalar()
+    if not total:
+        return 0
+    logger.info("Backfilling %s rows of %s", total, table)
+
+    if is_postgres():
+        batch = (
+            f'UPDATE "{table}" SET {assignment} WHERE {key} IN '
+            f'(SELECT {key} FROM "{table}" WHERE {where} LIMIT {batch_size} FOR UPDATE SKIP LOCKED)'
+        )
+        transactions = op.get_context().autocommit_block()
+    else:
+        # En local, une seule transaction suffit
+        batch = f'UPDATE "{table}" SET {assignment} WHERE {key} IN (SELECT {key} FROM "{table}" WHERE {where} LIMIT {batch_size})'
+        transactions = nullcontext()
+
+    done = 0
+    started = time.monotonic()
+    with transactions:
+        while True:
+            updated = op.get_bind().execute(sa.text(batch)).rowcount
+            if not updated:
+                break
+            done += updated
+            elapsed = time.monotonic() - started
+            logger.info("%s: %s/%s rows (%.0f rows/s)", table, done, total, done / elapsed if elapsed else 0)
+            time.sleep(pause)
+    return done
+
+
+def set_not_null(table, column):
+    # Pose NOT NULL sans parcourir la table sous verrou exclusif : la contrainte CHECK est validée
+    # sous un verrou qui laisse passer les écritures, et PostgreSQL s'en sert ensuite pour SET NOT NULL.
+    # Chaque étape est sa propre transaction : le verrou exclusif de ADD CONSTRAINT ... NOT VALID
+    # est relâché avant le parcours de la table par VALIDATE.
+    if not is_postgres():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column, nullable=False)
+        return
+
+    constraint = f"{table}_{column}_not_null"
+    with op.get_context().autocommit_block():
+        with lock_timeout():
+            op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT {constraint} CHECK ({column} IS NOT NULL) NOT VALID')
+        op.execute(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT {constraint}')
+    with lock_timeout():
+        op.execute(f'ALTER TABLE "{table}" ALTER COLUMN {column} SET NOT NULL')
+        op.execute(f'ALTER TABLE "{table}" DROP CONSTRAINT {constraint}')
+
+
+def create_index(name, table, columns, unique=False, **kw):
+    # CREATE INDEX CONCURRENTLY ne peut pas tourner dans une transaction : on sort de celle d'Alembic.
+    if not is_postgres():
+        op.create_index(name, table, columns, unique=unique, **kw)
+        return
+    with op.get_context().autocommit_block():
+        op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True, if_not_exists=True, **kw)
+
+
+def add_unique_constraint(name, table, columns):
+    # Construit l'index unique en concurrence puis l'attache comme contrainte, ce qui est instantané.
+    if not is_postgres():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_unique_constraint(name, columns)
+        return
+    create_index(name, table, columns, unique=True)
+    with lock_timeout():
+        op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT {name} UNIQUE USING INDEX {name}')
+
+
+def create_partial_index(name, table, columns, where):
+    # Index partiel (`where` en SQL). Sur une table partitionnée, CREATE INDEX CONCURRENTLY est refusé sur
+    # la table mère : l'index y est déclaré avec ON ONLY (sans rien construire), puis chaque partition
+    # reçoit le sien en concurrence avant d'y être attachée. Les partitions futures en héritent.
+    if not is_postgres():
+        op.create_index(name, table, columns, sqlite_where=sa.text(where))
+        return
+
+    partitions = op.get_bind().execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:table AS regclass) ORDER BY c.relname"
+    ), {"table": f'"{table}"'}).scalars().all()
+    if not partitions:
+        create_index(name, table, columns, postgresql_where=sa.text(where))
+        return
+
+    column_list = ', '.join(columns)
+    with lock_timeout():
+        op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON ONLY "{table}" ({column_list}) WHERE {where}')
+    for partition in partitions:
+        partition_index = f"{partition}_{name}"[:63]
+        with op.get_context().autocommit_block():
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON "{partition}" ({column_list}) WHERE {where}')
+        with lock_timeout():
+            op.execute(f'ALTER INDEX {name} ATTACH PARTITION {partition_index}')
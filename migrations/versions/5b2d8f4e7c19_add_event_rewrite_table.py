@@ -0,0 +1,34 @@
+"""Add event_rewrite table
+
+Revision ID: 5b2d8f4e7c19
+Revises: c47a9e2f1d05
+Create Date: 2026-10-19 13:41:52.604271
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2d8f4e7c19'
+down_revision = 'c47a9e2f1d05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('event_rewrite',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('input_hash', sa.String(length=64), nullable=False),
+    sa.Column('rewrite', sa.String(length=500), nullable=False),
+    sa.Column('hit_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('input_hash')
+    )
+    op.create_index('ix_event_rewrite_hit_count', 'event_rewrite', ['hit_count'])
+
+
+def downgrade():
+    op.drop_index('ix_event_rewrite_hit_count', table_name='event_rewrite')
+    op.drop_table('event_rewrite')
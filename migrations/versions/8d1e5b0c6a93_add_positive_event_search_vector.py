@@ -0,0 +1,37 @@
+"""Add full-text search vector on positive_event
+
+Revision ID: 8d1e5b0c6a93
+Revises: 3f9c2a7d41b8
+Create Date: 2026-10-19 10:02:47.190356
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d1e5b0c6a93'
+down_revision = '3f9c2a7d41b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Recherche plein texte propre à PostgreSQL : les autres bases utilisent le repli en Python
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    # Colonne générée : maintenue par PostgreSQL à chaque INSERT/UPDATE, sans trigger
+    op.execute(
+        "ALTER TABLE positive_event ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('french', description)) STORED"
+    )
+    # Index composite (user_id, search_vector) : la recherche est toujours limitée à un utilisateur
+    op.execute("CREATE INDEX ix_positive_event_user_search ON positive_event USING gin (user_id, search_vector)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX IF EXISTS ix_positive_event_user_search")
+    op.execute("ALTER TABLE positive_event DROP COLUMN IF EXISTS search_vector")
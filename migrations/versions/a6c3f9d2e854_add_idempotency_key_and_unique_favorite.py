@@ -0,0 +1,45 @@
+"""Add idempotency_key table and unique favorite per user and event
+
+Revision ID: a6c3f9d2e854
+Revises: e81f3a6b9d24
+Create Date: 2026-10-19 16:05:39.317462
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_ops import add_unique_constraint
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c3f9d2e854'
+down_revision = 'e81f3a6b9d24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('idempotency_key',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('fingerprint', sa.String(length=64), nullable=False),
+    sa.Column('status_code', sa.Integer(), nullable=True),
+    sa.Column('body', sa.LargeBinary(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'key')
+    )
+    op.create_index('ix_idempotency_key_expires_at', 'idempotency_key', ['expires_at'])
+
+    # Les favoris en double créés par la course de add_to_favorites sont supprimés avant la contrainte
+    op.execute("DELETE FROM favorite WHERE id NOT IN (SELECT min(id) FROM favorite GROUP BY user_id, event_id)")
+    add_unique_constraint('uq_favorite_user_event', 'favorite', ['user_id', 'event_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('favorite', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_favorite_user_event', type_='unique')
+    op.drop_index('ix_idempotency_key_expires_at', table_name='idempotency_key')
+    op.drop_table('idempotency_key')
@@ -0,0 +1,61 @@
+"""Add llm_usage and llm_usage_daily tables
+
+Revision ID: a8d3f6b1c274
+Revises: e7a2c4f9b153
+Create Date: 2026-10-19 21:26:43.190518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8d3f6b1c274'
+down_revision = 'e7a2c4f9b153'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('llm_usage',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('config_type', sa.String(length=50), nullable=False),
+    sa.Column('model', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.Integer(), nullable=False),
+    sa.Column('prompt_tokens', sa.Integer(), nullable=False),
+    sa.Column('completion_tokens', sa.Integer(), nullable=False),
+    sa.Column('latency_ms', sa.Integer(), nullable=False),
+    sa.Column('cost', sa.Float(), nullable=False),
+    sa.Column('shadow', sa.Boolean(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_llm_usage_created_at', 'llm_usage', ['created_at'])
+    op.create_index('ix_llm_usage_user_created_at', 'llm_usage', ['user_id', 'created_at'])
+    op.create_table('llm_usage_daily',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('config_type', sa.String(length=50), nullable=False),
+    sa.Column('model', sa.String(length=50), nullable=False),
+    sa.Column('shadow', sa.Boolean(), nullable=False),
+    sa.Column('calls', sa.Integer(), nullable=False),
+    sa.Column('errors', sa.Integer(), nullable=False),
+    sa.Column('prompt_tokens', sa.BigInteger(), nullable=False),
+    sa.Column('completion_tokens', sa.BigInteger(), nullable=False),
+    sa.Column('latency_ms', sa.BigInteger(), nullable=False),
+    sa.Column('cost', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_llm_usage_daily_day', 'llm_usage_daily', ['day'])
+    op.create_index('ix_llm_usage_daily_user_day', 'llm_usage_daily', ['user_id', 'day'])
+
+
+def downgrade():
+    op.drop_index('ix_llm_usage_daily_user_day', table_name='llm_usage_daily')
+    op.drop_index('ix_llm_usage_daily_day', table_name='llm_usage_daily')
+    op.drop_table('llm_usage_daily')
+    op.drop_index('ix_llm_usage_user_created_at', table_name='llm_usage')
+    op.drop_index('ix_llm_usage_created_at', table_name='llm_usage')
+    op.drop_table('llm_usage')
@@ -0,0 +1,43 @@
+"""Soft delete positive_event with deleted_at and partial indexes
+
+Revision ID: b3e9d7c2a418
+Revises: f4c8a1d6e2b7
+Create Date: 2026-10-19 19:20:41.266035
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_ops import add_column, create_index, create_partial_index, is_postgres, lock_timeout
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e9d7c2a418'
+down_revision = 'f4c8a1d6e2b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column('positive_event', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+    # Les lectures filtrent sur deleted_at IS NULL : l'index (user_id, date) ne garde que les lignes vivantes,
+    # et un second index ne contient que les lignes supprimées, pour le purgeur.
+    create_partial_index('ix_positive_event_user_date_live', 'positive_event', ['user_id', 'date'], 'deleted_at IS NULL')
+    create_partial_index('ix_positive_event_deleted_at', 'positive_event', ['deleted_at'], 'deleted_at IS NOT NULL')
+    if is_postgres():
+        with lock_timeout():
+            op.execute("DROP INDEX IF EXISTS ix_positive_event_user_date")
+
+    # Le purgeur efface les favoris par event_id
+    create_index('ix_favorite_event_id', 'favorite', ['event_id'])
+
+
+def downgrade():
+    op.drop_index('ix_favorite_event_id', table_name='favorite')
+    if is_postgres():
+        op.execute("CREATE INDEX IF NOT EXISTS ix_positive_event_user_date ON positive_event (user_id, date)")
+    op.drop_index('ix_positive_event_deleted_at', table_name='positive_event')
+    op.drop_index('ix_positive_event_user_date_live', table_name='positive_event')
+    with op.batch_alter_table('positive_event', schema=None) as batch_op:
+        batch_op.drop_column('deleted_at')
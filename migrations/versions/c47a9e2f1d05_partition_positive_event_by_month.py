@@ -0,0 +1,135 @@
+"""Partition positive_event by month
+
+Revision ID: c47a9e2f1d05
+Revises: 8d1e5b0c6a93
+Create Date: 2026-10-19 11:24:05.837112
+
+FENÊTRE DE MAINTENANCE OBLIGATOIRE. Contrairement aux migrations écrites avec
+online_ops, celle-ci recopie toute la table positive_event dans la nouvelle
+table partitionnée en une seule transaction, sous verrou exclusif : lectures et
+écritures des événements sont bloquées pendant toute la copie (compter environ
+une minute par million de lignes). À lancer application arrêtée :
+
+    heroku maintenance:on
+    heroku ps:scale web=0
+    heroku run flask --app kokuahuane db upgrade
+    heroku ps:scale web=1
+    heroku maintenance:off
+
+La migration refuse de démarrer si d'autres connexions sont ouvertes sur la
+base, sauf si KOKUA_MAINTENANCE_WINDOW=1 est défini.
+"""
+import logging
+import os
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47a9e2f1d05'
+down_revision = '8d1e5b0c6a93'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+logger = logging.getLogger('alembic.online')
+
+
+def add_months(month, count):
+    years, month_index = divmod(month.month - 1 + count, 12)
+    return datetime(month.year + years, month_index + 1, 1)
+
+
+def upgrade():
+    # Le partitionnement est propre à PostgreSQL : les autres bases gardent la table simple
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    # Copie complète sous verrou exclusif : on s'assure que l'application est bien arrêtée
+    others = bind.execute(sa.text(
+        "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()"
+    )).scalar()
+    if others and os.environ.get('KOKUA_MAINTENANCE_WINDOW') != '1':
+        raise RuntimeError(
+            f"{others} other connections are open: stop the web dynos first (see this migration's docstring) "
+            "or set KOKUA_MAINTENANCE_WINDOW=1"
+        )
+    logger.info("Copying %s rows into the partitioned table", bind.execute(sa.text("SELECT count(*) FROM positive_event")).scalar())
+
+    # Une clé étrangère ne peut viser une table partitionnée que via une contrainte incluant la date :
+    # l'application supprime déjà les favoris avec leur événement, on retire donc la contrainte.
+    op.execute("ALTER TABLE favorite DROP CONSTRAINT IF EXISTS favorite_event_id_fkey")
+    op.execute("DROP INDEX IF EXISTS ix_positive_event_user_search")
+    op.execute("ALTER TABLE positive_event RENAME TO positive_event_legacy")
+    op.execute("ALTER TABLE positive_event_legacy RENAME CONSTRAINT positive_event_pkey TO positive_event_legacy_pkey")
+    op.execute("ALTER SEQUENCE positive_event_id_seq OWNED BY NONE")
+    # La date devient la clé de partition : elle ne peut plus être nulle
+    op.execute("UPDATE positive_event_legacy SET date = timezone('utc', now()) WHERE date IS NULL")
+
+    op.execute("""
+        CREATE TABLE positive_event (
+            id integer NOT NULL DEFAULT nextval('positive_event_id_seq'),
+            user_id integer NOT NULL REFERENCES "user" (id),
+            description varchar(500) NOT NULL,
+            category varchar(100),
+            date timestamp without time zone NOT NULL,
+            search_vector tsvector GENERATED ALWAYS AS (to_tsvector('french', description)) STORED,
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date)
+    """)
+
+    # Une partition par mois, du plus ancien événement jusqu'à MONTHS_AHEAD mois dans le futur
+    oldest = bind.execute(sa.text("SELECT min(date) FROM positive_event_legacy")).scalar()
+    now = datetime.utcnow()
+    month = datetime((oldest or now).year, (oldest or now).month, 1)
+    last = add_months(datetime(now.year, now.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        following = add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE positive_event_p{month:%Y_%m} PARTITION OF positive_event "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{following:%Y-%m-%d}')"
+        )
+        month = following
+
+    op.execute("""
+        INSERT INTO positive_event (id, user_id, description, category, date)
+        SELECT id, user_id, description, category, date FROM positive_event_legacy
+    """)
+    op.execute("DROP TABLE positive_event_legacy")
+    op.execute("ALTER SEQUENCE positive_event_id_seq OWNED BY positive_event.id")
+
+    # Index déclarés sur la table mère : PostgreSQL les crée sur chaque partition, présente et future
+    op.execute("CREATE INDEX ix_positive_event_user_date ON positive_event (user_id, date)")
+    op.execute("CREATE INDEX ix_positive_event_user_search ON positive_event USING gin (user_id, search_vector)")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER TABLE positive_event RENAME TO positive_event_partitioned")
+    op.execute("ALTER SEQUENCE positive_event_id_seq OWNED BY NONE")
+    op.execute("""
+        CREATE TABLE positive_event (
+            id integer NOT NULL DEFAULT nextval('positive_event_id_seq') PRIMARY KEY,
+            user_id integer NOT NULL REFERENCES "user" (id),
+            description varchar(500) NOT NULL,
+            category varchar(100),
+            date timestamp without time zone,
+            search_vector tsvector GENERATED ALWAYS AS (to_tsvector('french', description)) STORED
+        )
+    """)
+    op.execute("""
+        INSERT INTO positive_event (id, user_id, description, category, date)
+        SELECT id, user_id, description, category, date FROM positive_event_partitioned
+    """)
+    op.execute("DROP TABLE positive_event_partitioned CASCADE")
+    op.execute("ALTER SEQUENCE positive_event_id_seq OWNED BY positive_event.id")
+    op.execute("CREATE INDEX ix_positive_event_user_search ON positive_event USING gin (user_id, search_vector)")
+    op.execute("DELETE FROM favorite WHERE event_id NOT IN (SELECT id FROM positive_event)")
+    op.execute("ALTER TABLE favorite ADD CONSTRAINT favorite_event_id_fkey FOREIGN KEY (event_id) REFERENCES positive_event (id)")
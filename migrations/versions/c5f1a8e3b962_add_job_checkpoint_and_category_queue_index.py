@@ -0,0 +1,35 @@
+"""Add job_checkpoint table and uncategorized events index
+
+Revision ID: c5f1a8e3b962
+Revises: b3e9d7c2a418
+Create Date: 2026-10-19 20:02:16.518374
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_ops import create_partial_index
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f1a8e3b962'
+down_revision = 'b3e9d7c2a418'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_checkpoint',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # File d'attente de classify-events : ne contient que les événements à classer
+    create_partial_index('ix_positive_event_uncategorized', 'positive_event', ['id'], 'category IS NULL AND deleted_at IS NULL')
+
+
+def downgrade():
+    op.drop_index('ix_positive_event_uncategorized', table_name='positive_event')
+    op.drop_table('job_checkpoint')
@@ -0,0 +1,30 @@
+"""Add user.timezone
+
+Revision ID: e7a2c4f9b153
+Revises: c5f1a8e3b962
+Create Date: 2026-10-19 20:41:55.073820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_ops import lock_timeout
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a2c4f9b153'
+down_revision = 'c5f1a8e3b962'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Valeur par défaut constante : PostgreSQL (11+) ajoute la colonne sans réécrire la table
+    with lock_timeout():
+        with op.batch_alter_table('user', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('timezone', sa.String(length=64), server_default='Europe/Paris', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('timezone')
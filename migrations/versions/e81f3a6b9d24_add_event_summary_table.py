@@ -0,0 +1,35 @@
+"""Add event_summary table
+
+Revision ID: e81f3a6b9d24
+Revises: 5b2d8f4e7c19
+Create Date: 2026-10-19 14:30:18.925740
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81f3a6b9d24'
+down_revision = '5b2d8f4e7c19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('event_summary',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.String(length=10), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('summary', sa.Text(), nullable=False),
+    sa.Column('fingerprint', sa.String(length=64), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'period', 'period_start')
+    )
+
+
+def downgrade():
+    op.drop_table('event_summary')
@@ -0,0 +1,30 @@
+"""Add user.is_admin
+
+Revision ID: f4c8a1d6e2b7
+Revises: d2b7e4a91c36
+Create Date: 2026-10-19 18:47:23.905614
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_ops import lock_timeout
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c8a1d6e2b7'
+down_revision = 'd2b7e4a91c36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Valeur par défaut constante : PostgreSQL (11+) ajoute la colonne sans réécrire la table
+    with lock_timeout():
+        with op.batch_alter_table('user', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('is_admin', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('is_admin')
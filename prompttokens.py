@@ -0,0 +1,50 @@
+import json
+import sys
+from kokuahuane import build_messages
+
+# Compare, pour chaque configuration de gpt_config.json, les tokens envoyés avec l'ancien format
+# (instructions + prompt dans un seul message user) et avec le format system/exemples actuel.
+# Usage : python prompttokens.py ["texte de l'utilisateur"]
+# Le décompte est exact si tiktoken est installé, approximatif (4 caractères par token) sinon.
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Surcoût par message et amorce de la réponse, d'après le format chat d'OpenAI
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+def count_text_tokens(text, model):
+    if tiktoken is None:
+        return max(1, len(text) // 4)
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding('cl100k_base')
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages, model):
+    return TOKENS_PER_REPLY + sum(TOKENS_PER_MESSAGE + count_text_tokens(message['content'], model) for message in messages)
+
+
+def legacy_messages(config, prompt):
+    return [{'role': 'user', 'content': f"{config['instructions']} {prompt}"}]
+
+
+prompt = sys.argv[1] if len(sys.argv) > 1 else "J'ai marché 30 minutes ce matin"
+with open('gpt_config.json', 'r') as file:
+    configs = json.load(file)
+
+print(f"{'config':<20}{'avant':>8}{'après':>8}{'préfixe stable':>16}{'variable':>10}")
+for config_type, config in configs.items():
+    model = config['model']
+    before = count_message_tokens(legacy_messages(config, prompt), model)
+    messages = build_messages(config, prompt)
+    after = count_message_tokens(messages, model)
+    variable = TOKENS_PER_MESSAGE + count_text_tokens(prompt, model)
+    print(f"{config_type:<20}{before:>8}{after:>8}{after - variable:>16}{variable:>10}")
+if tiktoken is None:
+    print("(tiktoken absent : décompte approximatif)")
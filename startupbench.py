@@ -0,0 +1,38 @@
+import os
+import statistics
+import subprocess
+import sys
+
+# Mesure le temps de démarrage d'un worker (import de kokuahuane + create_app) dans des processus neufs.
+# Usage : python startupbench.py [nombre d'essais]
+# Échoue si la médiane dépasse le budget, pour repérer un import lourd ajouté au chemin de démarrage.
+STARTUP_BUDGET_SECONDS = float(os.environ.get('STARTUP_BUDGET_SECONDS', 0.5))
+HEAVY_MODULES = ['alembic', 'flask_migrate', 'requests', 'dateutil']
+
+MEASURE = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import kokuahuane\n"
+    "elapsed = time.perf_counter() - start\n"
+    f"loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]\n"
+    "print(elapsed, ','.join(loaded))\n"
+)
+
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+env = dict(os.environ)
+env.setdefault('DATABASE_URL', 'sqlite://')
+env.setdefault('JWT_SECRET_KEY', 'startupbench')
+env.pop('FLASK_RUN_FROM_CLI', None)
+
+timings = []
+for _ in range(runs):
+    output = subprocess.run([sys.executable, '-c', MEASURE], env=env, capture_output=True, text=True, check=True).stdout
+    elapsed, _, loaded = output.strip().partition(' ')
+    timings.append(float(elapsed))
+
+median = statistics.median(timings)
+print(f"Démarrage : médiane {median * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms sur {runs} essais (budget {STARTUP_BUDGET_SECONDS * 1000:.0f} ms)")
+if loaded:
+    print(f"Modules lourds chargés au démarrage : {loaded}")
+if median > STARTUP_BUDGET_SECONDS or loaded:
+    sys.exit(1)
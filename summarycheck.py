@@ -0,0 +1,42 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Vérifie compute-summaries sur plusieurs lots : les commits entre deux lots ne doivent rien perdre
+# (sur PostgreSQL, un curseur serveur ouvert pendant ces commits ferait échouer le second lot).
+# Les appels au modèle sont remplacés par un résumé local : aucun appel réseau.
+# Usage : DATABASE_URL=postgresql://localhost/kokua_check python summarycheck.py [utilisateurs] [taille de lot]
+# La base doit être jetable : les tables y sont créées puis supprimées.
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('JWT_SECRET_KEY', 'summarycheck')
+os.environ.pop('FLASK_RUN_FROM_CLI', None)
+
+import kokuahuane
+from kokuahuane import EventSummary, PositiveEvent, User, app, compute_summaries, db
+
+users = int(sys.argv[1]) if len(sys.argv) > 1 else 25
+batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+kokuahuane.ask_gpt_mood = lambda prompt, config_type: f"{prompt.count(chr(10)) + 1} événements"
+
+with app.app_context():
+    db.create_all()
+    try:
+        today = datetime.utcnow()
+        for index in range(users):
+            user = User(email=f"summarycheck{index}@kokua.invalid", password='-', display_name=f"check {index}")
+            db.session.add(user)
+            db.session.flush()
+            db.session.add_all(PositiveEvent(user_id=user.id, description=f"Tu as fait le test {n}", date=today - timedelta(minutes=n))
+                               for n in range(index % 3 + 1))
+        db.session.commit()
+
+        computed = compute_summaries('week', concurrency=2, batch_size=batch_size)
+        stored = EventSummary.query.filter_by(period='week').count()
+        again = compute_summaries('week', concurrency=2, batch_size=batch_size)
+        print(f"{users} utilisateurs, lots de {batch_size} : {computed} résumés calculés, {stored} enregistrés, {again} recalculés au second passage")
+        ok = stored >= users and again == 0
+    finally:
+        db.session.rollback()
+        db.drop_all()
+
+sys.exit(0 if ok else 1)
@@ -0,0 +1,69 @@
+import os
+import sys
+import threading
+
+# Vérifie que les appels au modèle faits hors requête (thread sans contexte Flask, exécuteur de
+# classify-events) laissent bien leur ligne dans llm_usage et dans les agrégats de rollup-llm-usage.
+# L'API est remplacée par une réponse locale : aucun appel réseau.
+# Usage : DATABASE_URL=postgresql://localhost/kokua_check python usagecheck.py
+# La base doit être jetable : les tables y sont créées puis supprimées.
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('JWT_SECRET_KEY', 'usagecheck')
+os.environ.pop('FLASK_RUN_FROM_CLI', None)
+
+import kokuahuane
+from kokuahuane import LlmUsage, LlmUsageDaily, PositiveEvent, User, app, classify_pending_events, db, record_llm_usage, rollup_llm_usage, usage_ledger
+
+
+class StubResponse:
+    status_code = 200
+    text = ''
+
+    def json(self):
+        return {"choices": [{"message": {"content": '{"1": "sport"}'}}],
+                "usage": {"prompt_tokens": 12, "completion_tokens": 3}}
+
+
+class StubSession:
+    def post(self, url, json=None, **kwargs):
+        return StubResponse()
+
+
+kokuahuane.openai_session = lambda: StubSession()
+kokuahuane.model_router.shadow_model = lambda config_type, config, served_model: None
+
+with app.app_context():
+    db.create_all()
+    try:
+        user = User(email="usagecheck@kokua.invalid", password='-', display_name="check")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(PositiveEvent(user_id=user.id, description="Tu as fait quelque chose", date=kokuahuane.datetime.utcnow()))
+        db.session.commit()
+        PositiveEvent.query.update({PositiveEvent.category: None})
+        db.session.commit()
+    except Exception:
+        db.drop_all()
+        raise
+
+# Thread sans contexte Flask, comme un appel fantôme ou une tâche de fond
+thread = threading.Thread(target=record_llm_usage, args=('record', 'gpt-4o-mini', None, 200, 120, {"prompt_tokens": 5, "completion_tokens": 2}))
+thread.start()
+thread.join()
+written_from_thread = usage_ledger.flush()
+
+with app.app_context():
+    try:
+        classified, failed = classify_pending_events(concurrency=2)
+        written_from_executor = usage_ledger.flush()
+        rows = LlmUsage.query.count()
+        rolled_up = rollup_llm_usage(1)
+        calls = db.session.query(db.func.sum(LlmUsageDaily.calls)).scalar() or 0
+        print(f"thread : {written_from_thread} ligne(s) ; classify-events : {classified} classé(s), {written_from_executor} ligne(s) ; "
+              f"llm_usage : {rows} ligne(s), {rolled_up} agrégat(s), {calls} appel(s) comptés")
+        ok = written_from_thread == 1 and written_from_executor == 1 and rows == 2 and calls == 2
+    finally:
+        db.session.rollback()
+        db.drop_all()
+
+sys.exit(0 if ok else 1)